@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+"""
+Script to benchmark the stages of create_pages.py against bundled fixtures.
+Reports wall time, CPU time and peak memory per stage and fails on regressions
+against the baseline, which is saved with --save-baseline on the target machine.
+The query plan of the flash cards is also checked on a large synthetic database.
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import cedict
+import create_pages
+import download
+import glyphs
+import normalize
+import page_cache
+
+FIXTURES: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CEDICT_SAMPLE: str = os.path.join(FIXTURES, "cedict_sample.txt")
+BASELINE_FILE: str = os.path.join(FIXTURES, "benchmark_baseline.json")
+
+
+def create_pleco_database(path: str, cards: int = 2000, seed: int = 1):
+    """
+    Creates a synthetic Pleco database with the pleco_flash_* tables used by create_pages.py
+    """
+    with open(CEDICT_SAMPLE, encoding="utf-8") as f:
+        words: List[Tuple[str, str, str]] = []
+        for line in f:
+            if line.startswith("#"):
+                continue
+            characters, rest = line.split(" [", 1)
+            pinyin, english = rest.split("] /", 1)
+            words.append((characters.split()[1], pinyin, english.split("/")[0]))
+    generator = random.Random(seed)
+    with sqlite3.connect(path) as database:
+        database.executescript(
+            "create table pleco_flash_profilesettings (profile integer, propid text, propvalue text);"
+            + "create table pleco_flash_cards (id integer primary key, hw text, pron text, defn text);"
+            + "create table pleco_flash_scores_1 (card integer, score integer);"
+            + "create table pleco_flash_categoryassigns (card integer, cat integer);"
+            + "insert into pleco_flash_profilesettings values (1, 'pro_categories', '1,2,');"
+        )
+        for card in range(cards):
+            hw, pinyin, english = generator.choice(words)
+            pron: str = pinyin.replace(" ", "")
+            defn = generator.choice(
+                [None, english, f"{english}; more", f"• {english}\nsecond line"]
+            )
+            database.execute(
+                "insert into pleco_flash_cards values (?, ?, ?, ?)",
+                (card, f"@{hw}" if card % 7 == 0 else hw, pron, defn),
+            )
+            database.execute(
+                "insert into pleco_flash_scores_1 values (?, ?)",
+                (card, generator.randrange(10000)),
+            )
+            # Some cards are in several categories
+            for category in generator.sample([1, 2, 3], generator.choice([1, 1, 1, 2])):
+                database.execute(
+                    "insert into pleco_flash_categoryassigns values (?, ?)",
+                    (card, category),
+                )
+
+
+def check_query_plan(database_file: str) -> List[str]:
+    """
+    Returns the problems in the query plan of the flash cards query.
+    A table must not be scanned for every row of another table or a correlated subquery.
+    """
+    problems: List[str] = []
+    with contextlib.closing(create_pages.open_database(database_file)) as database:
+        plan = database.execute(
+            "explain query plan " + create_pages.cards_query(2, after=True),
+            (normalize.MAX_HW_LENGTH, 1, 2, 0, 0, create_pages.CARDS_BATCH_SIZE),
+        ).fetchall()
+    scans: Dict[int, List[str]] = {}
+    for _, parent, _, detail in plan:
+        if detail.startswith("CORRELATED"):
+            problems.append(f"subquery executed for every row: {detail}")
+        elif detail.startswith("SCAN ") and not detail.startswith("SCAN (") and "CONSTANT" not in detail:
+            scans.setdefault(parent, []).append(detail)
+    for details in scans.values():
+        for detail in details[1:]:
+            problems.append(f"nested full scan: {detail} for every row of {details[0]}")
+    return problems
+
+
+def measure(function: Callable, repeat: int) -> Tuple[object, Dict[str, float]]:
+    """
+    Runs the function repeatedly and returns its result with the best wall and CPU time.
+    The peak memory is measured in an additional run, because tracing slows it down.
+    """
+    wall_times: List[float] = []
+    cpu_times: List[float] = []
+    result = None
+    for _ in range(repeat):
+        wall: float = time.perf_counter()
+        cpu: float = time.process_time()
+        result = function()
+        cpu_times.append(time.process_time() - cpu)
+        wall_times.append(time.perf_counter() - wall)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "wall_s": min(wall_times),
+        "cpu_s": min(cpu_times),
+        "peak_bytes": peak,
+    }
+
+
+def run(repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Runs all stages in the order of create_pages.py and returns their metrics
+    """
+    metrics: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory(prefix="hanzihua-benchmark-") as tmp:
+        with open(CEDICT_SAMPLE, "rb") as f:
+            cedict_gzip: bytes = gzip.compress(f.read())
+        source_file: str = os.path.join(tmp, "source.pqb")
+        create_pleco_database(source_file)
+        out_dir: str = os.path.join(tmp, "out")
+        os.makedirs(out_dir)
+
+        cedict_file: str = os.path.join(tmp, "cedict.sqlite")
+
+        def load_dictionary():
+            database = cedict.open_cache(cedict_file)
+            cedict.fill_cache(database, io.BytesIO(cedict_gzip), {})
+            database.close()
+            # Builds the index, as the cache has been changed
+            cedict.load(cedict_file, update=False).close()
+
+        def lookup_dictionary() -> List[Optional[str]]:
+            cedict.load(cedict_file, update=False).close()
+            return [cedict.lookup(simplified) for simplified in words]
+
+        def lookup_dict() -> List[Optional[str]]:
+            # Dictionary in memory as it was used before the index
+            translations: Dict[str, str] = dict(cedict.iter_ce_ccdict(io.BytesIO(cedict_gzip)))
+            return [translations.get(simplified) for simplified in words]
+
+        def fetch_database() -> str:
+            def fetch_range(start: int, end: int) -> Iterable[bytes]:
+                with open(source_file, "rb") as f:
+                    f.seek(start)
+                    yield f.read(end + 1 - start)
+
+            database_file: str = os.path.join(tmp, "flashbackup.pqb")
+            download.download(database_file, os.path.getsize(source_file), fetch_range)
+            return database_file
+
+        load_dictionary()
+        words: List[str] = [
+            simplified for simplified, _ in cedict.iter_ce_ccdict(io.BytesIO(cedict_gzip))
+        ]
+        stages: List[Tuple[str, Callable]] = [
+            ("dictionary load", load_dictionary),
+            ("index lookups", lookup_dictionary),
+            ("dict lookups", lookup_dict),
+            ("database fetch", fetch_database),
+        ]
+        for name, function in stages:
+            _, metrics[name] = measure(function, repeat)
+        database_file: str = fetch_database()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            cards, metrics["card query"] = measure(
+                lambda: list(create_pages.query_cards(database_file)), repeat
+            )
+            # Without memoized results and with the results memoized by a previous run
+            normalize_file: str = os.path.join(tmp, "normalize.sqlite")
+            _, metrics["normalize cold"] = measure(
+                lambda: normalize.Normalizer(":memory:").normalize(cards), repeat
+            )
+            normalize.Normalizer(normalize_file).normalize(cards)
+            _, metrics["normalize warm"] = measure(
+                lambda: normalize.Normalizer(normalize_file).normalize(cards), repeat
+            )
+            create_pages.NORMALIZER = normalize.Normalizer(normalize_file)
+            create_pages.GLYPHS_CHINESE = glyphs.GlyphCache(
+                create_pages.FONT_CHINESE, os.path.join(tmp, "glyphs.sqlite")
+            )
+            pages, metrics["text cleanup"] = measure(
+                lambda: create_pages.select_pages(cards), repeat
+            )
+        images, metrics["render"] = measure(
+            lambda: [create_pages.draw_page(page) for page in pages], repeat
+        )
+        _, metrics["encode/save"] = measure(
+            lambda: [
+                create_pages.save_page(page, image, out_dir)
+                for page, image in zip(pages, images)
+            ],
+            repeat,
+        )
+        # All pages are hits after the first run
+        create_pages.PAGE_CACHE = page_cache.PageCache(os.path.join(tmp, "pages"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_pages.write_pages(pages, 1, out_dir)
+            _, metrics["cached pages"] = measure(
+                lambda: create_pages.write_pages(pages, 1, out_dir), repeat
+            )
+    return metrics
+
+
+def run_large(cards: int, repeat: int) -> Tuple[Dict[str, float], List[str]]:
+    """
+    Measures the query of the cards for a month and checks its query plan
+    on a large synthetic database
+    """
+    with tempfile.TemporaryDirectory(prefix="hanzihua-benchmark-") as tmp:
+        database_file: str = os.path.join(tmp, "large.pqb")
+        create_pleco_database(database_file, cards)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, large_metrics = measure(
+                lambda: list(itertools.islice(create_pages.query_cards(database_file), 31)),
+                repeat,
+            )
+        return large_metrics, check_query_plan(database_file)
+
+
+def compare(
+    metrics: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """
+    Returns the metrics, which are worse than the baseline by more than the tolerance
+    """
+    regressions: List[str] = []
+    for stage, values in metrics.items():
+        for key in ("wall_s", "peak_bytes"):
+            if stage in baseline and values[key] > baseline[stage][key] * (1 + tolerance):
+                regressions.append(
+                    f"{stage} {key}: {values[key]:.4g}, baseline {baseline[stage][key]:.4g}"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against the baseline, 0.25 means 25%%",
+    )
+    parser.add_argument(
+        "--large-cards",
+        type=int,
+        default=100000,
+        help="cards of the large database for the query plan check, 0 to skip it",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="save the results as new baseline"
+    )
+    args = parser.parse_args()
+
+    benchmark_metrics = run(args.repeat)
+    plan_problems: List[str] = []
+    if args.large_cards > 0:
+        benchmark_metrics["large query"], plan_problems = run_large(
+            args.large_cards, args.repeat
+        )
+    print(f"{'stage':<16}{'wall ms':>10}{'cpu ms':>10}{'peak kB':>10}")
+    for stage_name, stage_metrics in benchmark_metrics.items():
+        print(
+            f"{stage_name:<16}{stage_metrics['wall_s'] * 1000:>10.1f}"
+            + f"{stage_metrics['cpu_s'] * 1000:>10.1f}"
+            + f"{stage_metrics['peak_bytes'] / 1024:>10.0f}"
+        )
+    for problem in plan_problems:
+        print("Query plan:", problem)
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(benchmark_metrics, f, indent=2)
+        print("Baseline saved to", BASELINE_FILE)
+    elif os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            found_regressions = compare(benchmark_metrics, json.load(f), args.tolerance)
+        for regression in found_regressions:
+            print("Regression:", regression)
+        if found_regressions:
+            sys.exit(1)
+    else:
+        print("No baseline, save one with --save-baseline")
+    if plan_problems:
+        sys.exit(1)
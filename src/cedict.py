@@ -0,0 +1,202 @@
+"""
+Translations from CC-CEDICT, which are used if a flash card has no definition.
+The parsed dictionary is cached in a SQLite database and only downloaded again,
+if it has been changed upstream. Lookups are made in a compact index built from the cache,
+which is memory mapped, so the dictionary is never loaded into memory.
+Nothing is loaded until the first lookup, unless load() is called ahead, e.g. in another thread.
+Lookups wait until a running load is finished. If loading failed, lookups find no translation.
+"""
+
+import gzip
+import os
+import sqlite3
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import requests
+import urllib3
+import cedict_index
+import download
+import metrics
+
+URL_CC_CEDICT_DATABASE: str = (
+    "https://www.mdbg.net/chinese/export/cedict/cedict_1_0_ts_utf-8_mdbg.txt.gz"
+)
+CACHE_FILE: str = "cache/cedict.sqlite"
+
+# Errors of the download, after which it is retried or the cached dictionary is used
+FETCH_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError, OSError, EOFError)
+
+_index: Optional[cedict_index.IndexReader] = None
+# Error of the last load, so the download is not attempted again by every lookup
+_load_error: Optional[Exception] = None
+_lock = threading.RLock()
+
+
+def lookup(simplified: str) -> Optional[str]:
+    """
+    Returns the English translation of a word in simplified Chinese or None,
+    also if the dictionary could not be loaded
+    """
+    if _index is None:
+        with _lock:
+            if _index is None and _load_error is None:
+                try:
+                    load()
+                except Exception as e:
+                    print("CC-CEDICT could not be loaded:", e)
+    if _index is None:
+        return None
+    return _index.get(simplified)
+
+
+def load(cache_file: str = CACHE_FILE, update: bool = True) -> sqlite3.Connection:
+    """
+    Opens the cache and updates it, if requested.
+    The index used for lookups is rebuilt, if the cache has been changed since.
+    If it fails, the error is kept and lookups return None instead of loading again.
+    """
+    global _index, _load_error
+    with _lock:
+        try:
+            database: sqlite3.Connection = open_cache(cache_file)
+            if update:
+                with metrics.stage("cedict_refresh"):
+                    refresh(database)
+            index_file: str = f"{os.path.splitext(cache_file)[0]}.idx"
+            if not os.path.exists(index_file) or os.path.getmtime(
+                index_file
+            ) < os.path.getmtime(cache_file):
+                with metrics.stage("cedict_index"):
+                    build_index(database, index_file)
+            if _index is not None:
+                _index.close()
+            # Only provided for lookups once it is updated
+            _index = cedict_index.IndexReader(index_file)
+        except Exception as e:
+            _load_error = e
+            raise
+        _load_error = None
+    return database
+
+
+def open_cache(cache_file: str = CACHE_FILE) -> sqlite3.Connection:
+    """
+    Opens the cache and creates its tables, if necessary
+    """
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    # Lookups may be made from another thread than the one which loaded the dictionary
+    database = sqlite3.connect(cache_file, check_same_thread=False)
+    database.execute(
+        "create table if not exists entries "
+        + "(simplified text primary key, english text not null)"
+    )
+    database.execute(
+        "create table if not exists meta (key text primary key, value text not null)"
+    )
+    return database
+
+
+def refresh(database: sqlite3.Connection):
+    """
+    Downloads and parses the dictionary, if it has been changed since it was cached.
+    The download is decompressed and parsed while it is streamed into the cache.
+    """
+    meta: Dict[str, str] = dict(database.execute("select key, value from meta"))
+    headers: Dict[str, str] = {}
+    if "etag" in meta:
+        headers["If-None-Match"] = meta["etag"]
+    if "last-modified" in meta:
+        headers["If-Modified-Since"] = meta["last-modified"]
+    try:
+        updated: bool = download.retry(
+            lambda: fetch(database, headers), "cedict", FETCH_ERRORS
+        )
+    except FETCH_ERRORS as e:
+        if meta:
+            print("Using cached CC-CEDICT, download failed:", e)
+            return
+        raise
+    if updated:
+        print(
+            "Updated CC-CEDICT:",
+            database.execute("select count(*) from entries").fetchone()[0],
+            "entries",
+        )
+
+
+def fetch(database: sqlite3.Connection, headers: Dict[str, str]) -> bool:
+    """
+    Downloads the dictionary into the cache, unless the conditional request finds it unchanged.
+    Returns, if it has been updated.
+    """
+    with requests.get(
+        URL_CC_CEDICT_DATABASE, headers=headers, stream=True, timeout=download.TIMEOUT
+    ) as r:
+        if r.status_code == 304:
+            metrics.record("cedict_updated", 0)
+            return False
+        r.raise_for_status()
+        r.raw.decode_content = True
+        fill_cache(
+            database,
+            r.raw,
+            {key: r.headers[key] for key in ("etag", "last-modified") if key in r.headers},
+        )
+        metrics.count("cedict_bytes", r.raw.tell())
+        metrics.record("cedict_updated", 1)
+    return True
+
+
+def build_index(database: sqlite3.Connection, index_file: str):
+    """
+    Writes the cached dictionary into the index used for lookups
+    """
+    (count,) = database.execute("select count(*) from entries").fetchone()
+    # The primary key returns the entries sorted by their UTF-8 bytes
+    cedict_index.write(
+        index_file,
+        database.execute("select simplified, english from entries order by simplified"),
+        count,
+    )
+
+
+def fill_cache(database: sqlite3.Connection, stream: BinaryIO, meta: Dict[str, str]):
+    """
+    Replaces the cached dictionary with the gzipped database read from the stream
+    """
+    with database:
+        database.execute("delete from entries")
+        database.executemany(
+            "insert or replace into entries values (?, ?)", iter_ce_ccdict(stream)
+        )
+        database.execute("delete from meta")
+        database.executemany("insert into meta values (?, ?)", meta.items())
+
+
+def iter_ce_ccdict(stream: BinaryIO) -> Iterator[Tuple[str, str]]:
+    """
+    Decompresses the gzipped database with translations line by line
+    and yields the cleaned translations as (simplified, english)
+    """
+    with gzip.GzipFile(fileobj=stream) as ce_ccdict_file:
+        for entry_bytes in ce_ccdict_file:
+            line: str = entry_bytes.decode().rstrip("\r\n")
+            if line.startswith("#"):
+                continue
+            # Credits:
+            # https://github.com/rubber-duck-dragon/rubber-duck-dragon.github.io/blob/master/cc-cedict_parser/parser.py
+            line = line.rstrip("/")
+            lines: List[str] = line.split("/")
+            if len(lines) <= 1:
+                continue
+            english: str = lines[1]
+            char_and_pinyin: List[str] = lines[0].split("[")
+            characters: List[str] = char_and_pinyin[0].split()
+            simplified: str = characters[1]
+            if "variant of" in english:
+                continue
+            if english.startswith("used in"):
+                continue
+            if english.startswith("surname"):
+                continue
+            yield simplified, english
@@ -0,0 +1,95 @@
+"""
+Compact index of CC-CEDICT for lookups without loading the dictionary.
+The file is memory mapped and searched with a binary search, so a lookup only touches a few pages.
+
+Layout: a header (magic, version, number of entries) followed by 2 * entries + 1 offsets and
+a blob of UTF-8 strings. Entry i has its key from offset 2i to 2i + 1 and its value from
+offset 2i + 1 to 2i + 2. The keys are sorted by their UTF-8 bytes like the primary key of
+the SQLite cache.
+"""
+
+import mmap
+import os
+import struct
+from array import array
+from typing import Iterable, Optional, Tuple
+
+MAGIC: bytes = b"HZCI"
+VERSION: int = 1
+HEADER = struct.Struct("<4sHI")
+OFFSET = struct.Struct("<I")
+
+
+def write(path: str, entries: Iterable[Tuple[str, str]], count: int):
+    """
+    Writes the given number of entries sorted by key into an index file.
+    The file is written to a temporary path and moved into place.
+    """
+    tmp_path: str = f"{path}.tmp"
+    offsets = array("I")
+    blob_start: int = HEADER.size + (2 * count + 1) * OFFSET.size
+    with open(tmp_path, "wb") as f:
+        f.seek(blob_start)
+        position: int = 0
+        for key, value in entries:
+            for string in (key, value):
+                encoded: bytes = string.encode("utf-8")
+                offsets.append(position)
+                f.write(encoded)
+                position += len(encoded)
+        offsets.append(position)
+        if len(offsets) != 2 * count + 1:
+            os.unlink(tmp_path)
+            raise ValueError(f"Expected {count} entries, got {(len(offsets) - 1) // 2}")
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, count))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+    os.replace(tmp_path, path)
+
+
+class IndexReader:
+    """
+    Memory maps an index file and looks up entries with a binary search
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"Unsupported index file: {path}")
+        self._blob_start: int = HEADER.size + (2 * self.count + 1) * OFFSET.size
+
+    def __enter__(self) -> "IndexReader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _string(self, i: int) -> bytes:
+        start, end = struct.unpack_from("<II", self._mmap, HEADER.size + i * OFFSET.size)
+        return self._mmap[self._blob_start + start : self._blob_start + end]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the value of the key or None
+        """
+        wanted: bytes = key.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle: int = (low + high) // 2
+            found: bytes = self._string(2 * middle)
+            if found < wanted:
+                low = middle + 1
+            elif found > wanted:
+                high = middle
+            else:
+                return self._string(2 * middle + 1).decode("utf-8")
+        return None
+
+    def close(self):
+        """
+        Unmaps the file
+        """
+        self._mmap.close()
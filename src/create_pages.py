@@ -2,199 +2,596 @@
 """
 Script to create the pages for each day of a month.
 Link it in /etc/cron.monthly to run it monthly. Should be run as non-root.
+With --daily, it creates only the page of today and can be linked in /etc/cron.daily instead.
 """
 
-import re
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import pathlib
 import sqlite3
 import sys
-import tempfile
-import os
-import gzip
-from typing import Union, Dict, List
-import requests
-import boto3
-from dragonmapper import transcriptions
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
-import config
+import cedict
+import frames
+import glyphs
+import layout
+import metrics
+import normalize
+import page_cache
+import pleco
+from waveshare_epd import framebuffer
 
 # Settings
-URL_PLECO_FLASHCARD_DATABASE: str = "http://raspi4/sync/phone/pleco/flashbackup.pqb"
-URL_CC_CEDICT_DATABASE: str = (
-    "https://www.mdbg.net/chinese/export/cedict/cedict_1_0_ts_utf-8_mdbg.txt.gz"
-)
 FONT_CHINESE = ImageFont.truetype(
     "/usr/share/fonts/opentype/noto/NotoSerifCJK-Bold.ttc", 190
 )
 FONT_LATIN = ImageFont.truetype(
     "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf", 40
 )
+GLYPHS_CHINESE = glyphs.GlyphCache(FONT_CHINESE)
+# Too long pinyin and translations are shown in smaller sizes of FONT_LATIN down to this size
+FONT_LATIN_MIN_SIZE: int = 24
+# Lines a translation may be wrapped to, they are stacked upwards from its usual position
+DEFN_MAX_LINES: int = 2
+LAYOUT_LATIN = layout.TextFitter(FONT_LATIN, FONT_LATIN_MIN_SIZE)
+NORMALIZER = normalize.Normalizer()
+PAGE_CACHE = page_cache.PageCache()
+OUT_DIR: str = "out"
+# Write the pages also in the buffer format of the e-Paper to a frames file in OUT_DIR
+WRITE_FRAMES: bool = True
+# Flash cards fetched from the database at once, more are fetched if too many are skipped
+CARDS_BATCH_SIZE: int = 64
+# Page cache of SQLite for the Pleco database
+CACHE_SIZE_KIB: int = 16 * 1024
 HEIGHT: int = 384
 WIDTH: int = 640
 
-SIZE: tuple[int, int] = (WIDTH, HEIGHT)
-CENTER_HEIGHT: int = int(HEIGHT / 2)
-CENTER_WIDTH: int = int(WIDTH / 2)
+# Vertical centers of Chinese, pinyin and translation relative to the center of the page
+HW_OFFSET: int = -30
+PRON_OFFSET: int = -150
+DEFN_OFFSET: int = 150
+# Increase, if pages are drawn differently, so the pages in the cache are not used anymore
+RENDER_VERSION: int = 1
+
+
+Card = normalize.Card
+
+
+class Page(NamedTuple):
+    """
+    Cleaned flash card, which is shown on a day of month
+    """
+
+    day_of_month: int
+    hw: str
+    pron: str
+    defn: str
+    pron_fit: layout.Fit
+    defn_fit: layout.Fit
+    width: int = WIDTH
+    height: int = HEIGHT
+
+
+class Profile(NamedTuple):
+    """
+    Frame, for which pages are created
+    """
 
+    name: str
+    # Local copy of the Pleco database
+    database_file: str = pleco.DATABASE_FILE
+    # Prefix of the backups in the bucket, None for config.PREFIX
+    prefix: Optional[str] = None
+    # Flash card categories, None for the categories selected for learning in Pleco
+    categories: Optional[List[int]] = None
+    out_dir: str = OUT_DIR
+    width: int = WIDTH
+    height: int = HEIGHT
 
-def main():
+
+def main(jobs: int = 1, profiles: Optional[List[Profile]] = None, daily: bool = False):
     """
-    Main function, which downloads the Pleco Database and creates the pages for each day
+    Main function, which downloads the Pleco Databases and creates the pages for each day.
+    Without profiles, the pages of a single frame are created as configured in config.
+    In daily mode, only the page of today is created from the next card not shown yet.
+    CC-CEDICT and the databases of all profiles are fetched concurrently and the pages of
+    a profile are created as soon as its database has arrived. The pages of all profiles are
+    rendered in this process by the given number of processes, sharing the dictionary, fonts and
+    caches. A card shown on several frames is thus only cleaned and rendered once.
+    If the pages of a profile can not be created, e.g. as its database can not be fetched,
+    the other profiles are still created and the script exits with an error at the end.
     """
-    # Download Database
-    _, pleco_database_file = tempfile.mkstemp(prefix="hanzihua-")
+    if profiles is None:
+        profiles = [Profile("default")]
+    failed: List[str] = []
+    with metrics.run("create_pages"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(profiles) + 1) as executor:
+            # Lookups of cards without definition wait until the dictionary is updated
+            dictionary = executor.submit(cedict.load)
+            fetches = {executor.submit(fetch_database, profile): profile for profile in profiles}
+            for fetch in concurrent.futures.as_completed(fetches):
+                profile: Profile = fetches[fetch]
+                try:
+                    create_profile_pages(profile, fetch.result(), jobs, daily, len(profiles) > 1)
+                # Whatever went wrong, it must not keep the other frames from getting pages.
+                # selected_categories exits, if the database has no categories selected.
+                except (Exception, SystemExit) as e:
+                    print(f"Pages of profile {profile.name} could not be created:", e)
+                    metrics.count("profiles_failed")
+                    failed.append(profile.name)
+            if dictionary.exception() is not None:
+                print("CC-CEDICT could not be loaded:", dictionary.exception())
+        if failed:
+            print("No pages created for:", ", ".join(failed))
+            sys.exit(1)
 
-    download_database(pleco_database_file)
 
-    with open(pleco_database_file, "wb") as f:
-        with requests.get(URL_PLECO_FLASHCARD_DATABASE) as r:
-            f.write(r.content)
-    with sqlite3.connect(pleco_database_file) as database:
-        # Get categories of flash cards, which are currently selected for learning
-        category_entries = database.cursor().execute(
-            "select propvalue from pleco_flash_profilesettings "
-            + 'where propid="pro_categories" and propvalue not null'
+def create_profile_pages(
+    profile: Profile, database_file: str, jobs: int = 1, daily: bool = False, named: bool = False
+):
+    """
+    Creates the pages of a profile from its fetched database, the name is printed if requested
+    """
+    if named:
+        print("Profile:", profile.name)
+    os.makedirs(profile.out_dir, exist_ok=True)
+    if daily:
+        create_daily_page(profile, database_file, datetime.date.today())
+        return
+    # Cards are only queried as long as pages are missing
+    with metrics.stage("card_selection"):
+        pages: List[Page] = select_pages(
+            query_cards(database_file, profile.categories),
+            profile.width,
+            profile.height,
         )
-        if category_entries.arraysize < 1:
-            print("Please select flash card categories in Pleco")
-            sys.exit()
-
-        categories: str | None = None
-        for category_entry in category_entries:
-            categories = category_entry[0][0:-1]  # Remove trailing comma
-        if categories is None or not re.match("[0-9,-]", categories):
-            print("Unexpected format for category list: ", categories)
-            sys.exit()
-        print("Categories:", categories)
+    with metrics.stage("render"):
+        write_pages(pages, jobs, profile.out_dir, profile.width, profile.height)
+    metrics.count("pages", len(pages))
+
+
+def fetch_database(profile: Profile) -> str:
+    """
+    Updates the local copy of the database of the profile and returns its path
+    """
+    with metrics.stage("database_fetch"):
+        return pleco.sync_database(profile.database_file, profile.prefix)
+
 
-        # Get flash cards sorted by score hw=Chinese pron=Pronunciation, defn=Definition
-        cards = database.cursor().execute(
-            "select c.hw, c.pron, c.defn "
-            + "from pleco_flash_scores_1 s, pleco_flash_cards c, pleco_flash_categoryassigns ca "
-            + "where c.id = s.card and c.id = ca.card and ca.cat IN("
-            + categories
-            + ") order by s.score limit 60"
+def create_daily_page(profile: Profile, database_file: str, today: datetime.date):
+    """
+    Creates the page of today from the card with the lowest score, which has not been shown yet,
+    and remembers it as shown. Running it again on the same day picks the same card.
+    """
+    shown: Dict[str, str] = load_shown(database_file, today)
+    with metrics.stage("card_selection"):
+        page: Optional[Page] = select_daily_page(
+            query_cards(database_file, profile.categories),
+            shown,
+            today,
+            profile.width,
+            profile.height,
         )
+        if page is None and shown:
+            print("All cards have been shown, starting over")
+            shown = {}
+            page = select_daily_page(
+                query_cards(database_file, profile.categories),
+                shown,
+                today,
+                profile.width,
+                profile.height,
+            )
+    if page is None:
+        print("No card to show")
+        return
+    with metrics.stage("render"):
+        write_daily_page(page, profile.out_dir, profile.width, profile.height)
+    save_shown(database_file, shown)
+    metrics.count("pages")
 
-        day_of_month: int = 1
-        for hw, pron, defn in cards:
-            # Try to create page
-            if create_page(day_of_month, defn, hw, pron):
-                day_of_month += 1
-            if day_of_month == 32:
-                break
-    # Tidy up
-    os.unlink(pleco_database_file)
-
-
-def download_database(pleco_database_file):
-    s3 = boto3.client("s3", region_name=config.REGION)
-    databases = s3.list_objects_v2(
-        Bucket=config.BUCKET,
-        Prefix=config.PREFIX,
-    )
-    latest_database = databases.get("Contents", [])[0].get("Key", "")
-    for database in databases.get("Contents", []):
-        if database.get("Key", "") > latest_database:
-            latest_database = database.get("Key", "")
-    print("Latest database:", latest_database)
-    s3.download_file(
-        Bucket=config.BUCKET,
-        Key=latest_database,
-        Filename=pleco_database_file,
+
+def shown_file(database_file: str) -> str:
+    """
+    Returns the path of the cards shown in daily mode, which belongs to the database file
+    """
+    return os.path.splitext(database_file)[0] + ".shown.json"
+
+
+def load_shown(database_file: str, today: datetime.date) -> Dict[str, str]:
+    """
+    Loads the keys of the cards shown in daily mode with the dates they were shown.
+    The card of today is left out, so it is picked again.
+    """
+    try:
+        with open(shown_file(database_file), encoding="utf-8") as f:
+            shown: Dict[str, str] = json.load(f)["shown"]
+    except FileNotFoundError:
+        return {}
+    return {key: date for key, date in shown.items() if date != today.isoformat()}
+
+
+def save_shown(database_file: str, shown: Dict[str, str]):
+    """
+    Saves the keys of the cards shown in daily mode
+    """
+    path: str = shown_file(database_file)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"shown": shown}, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_profiles(profiles_file: str) -> List[Profile]:
+    """
+    Reads the profiles from a JSON list of objects with the fields of Profile.
+    The database of a profile is stored in cache/{name}.pqb by default.
+    """
+    with open(profiles_file, encoding="utf-8") as f:
+        entries: List[Dict] = json.load(f)
+    profiles: List[Profile] = []
+    for entry in entries:
+        entry.setdefault("database_file", f"cache/{entry['name']}.pqb")
+        profiles.append(Profile(**entry))
+    if len({profile.database_file for profile in profiles}) < len(profiles):
+        raise ValueError("Profiles must not share their database file")
+    return profiles
+
+
+def query_cards(
+    pleco_database_file: str, categories: Optional[List[int]] = None
+) -> Iterator[Card]:
+    """
+    Yields the flash cards of the given categories sorted by score,
+    by default of the categories selected for learning.
+    Cards with too long Chinese are already skipped by the query.
+    The cards are fetched in batches, so only as many cards are read as are consumed.
+    """
+    with contextlib.closing(open_database(pleco_database_file)) as database:
+        if categories is None:
+            categories = selected_categories(database)
+        print("Categories:", categories)
+
+        # Get flash cards sorted by score, continuing after the last card of the previous batch
+        after: Optional[Tuple[int, int]] = None
+        while True:
+            rows = database.execute(
+                cards_query(len(categories), after is not None),
+                (normalize.MAX_HW_LENGTH, *categories, *(after or ()), CARDS_BATCH_SIZE),
+            ).fetchall()
+            metrics.count("card_batches")
+            for card_id, score, hw, pron, defn in rows:
+                after = (score, card_id)
+                yield hw, pron, defn
+            if len(rows) < CARDS_BATCH_SIZE:
+                return
+
+
+def selected_categories(database: sqlite3.Connection) -> List[int]:
+    """
+    Returns the categories of flash cards, which are currently selected for learning
+    """
+    category_entries = database.execute(
+        "select propvalue from pleco_flash_profilesettings "
+        + 'where propid="pro_categories" and propvalue not null'
+    ).fetchall()
+    if not category_entries:
+        print("Please select flash card categories in Pleco")
+        sys.exit()
+
+    categories_entry: str = category_entries[-1][0]
+    try:
+        categories: List[int] = [
+            int(category) for category in categories_entry.split(",") if category
+        ]
+    except ValueError:
+        categories = []
+    if not categories:
+        print("Unexpected format for category list: ", categories_entry)
+        sys.exit()
+    return categories
+
+
+def open_database(pleco_database_file: str) -> sqlite3.Connection:
+    """
+    Opens the downloaded database read-only without locking, as it is not changed while in use
+    """
+    uri: str = pathlib.Path(pleco_database_file).resolve().as_uri() + "?mode=ro&immutable=1"
+    database: sqlite3.Connection = sqlite3.connect(uri, uri=True)
+    database.execute(f"pragma cache_size = -{CACHE_SIZE_KIB}")
+    return database
+
+
+def cards_query(category_count: int, after: bool = False) -> str:
+    """
+    Returns the query of a batch of flash cards for the given number of categories.
+    Cards in several of the categories are only returned once.
+    If after is set, the batch starts after the given score and card id.
+    """
+    placeholders: str = ", ".join("?" * category_count)
+    # Cards without a score row are left out like before, a NULL score is treated as 0
+    score: str = "ifnull(s.score, 0)"
+    return (
+        f"select c.id, {score}, c.hw, c.pron, c.defn "
+        + "from pleco_flash_cards c join pleco_flash_scores_1 s on s.card = c.id "
+        + "where c.hw not null and length(replace(c.hw, '@', '')) <= ? "
+        + "and c.id in (select ca.card from pleco_flash_categoryassigns ca "
+        + f"where ca.cat in ({placeholders})) "
+        + (f"and ({score}, c.id) > (?, ?) " if after else "")
+        + f"order by {score}, c.id limit ?"
     )
 
 
-def create_page(day_of_month: int, defn: str, hw: str, pron: str) -> bool:
-    """
-    Creates page for day of month based on database entry.
-    Cleans the defintions and return True, if page has been created.
-    """
-    # Tidy up
-    hw = hw.replace("@", "")
-    if len(hw) > 3:
-        # Skip long words
-        print("Too long Chinese:", hw)
-        return False
-    pron = pron.replace("@", "")
-    pron = pron.replace("/", "")
-    pron = transcriptions.numbered_to_accented(pron)
-    if defn is None:
-        if hw in CE_CCDICT:
-            defn = CE_CCDICT[hw]
-            defn = defn.split(";")[0]
-        else:
-            print("No Translation:", hw, pron)
-            return False
+def write_pages(
+    pages: List[Page],
+    jobs: int = 1,
+    out_dir: str = OUT_DIR,
+    width: int = WIDTH,
+    height: int = HEIGHT,
+):
+    """
+    Saves the pages of the month and their frames file
+    """
+    buffers: Dict[int, Optional[bytes]] = render_pages(pages, jobs, out_dir)
+    if WRITE_FRAMES:
+        with frames.FrameWriter(f"{out_dir}/{frames.FILENAME}", width, height) as frame_writer:
+            for page in pages:
+                frame_writer.write(page.day_of_month, buffers[page.day_of_month])
+    else:
+        remove_frames(out_dir)
+
+
+def write_daily_page(page: Page, out_dir: str = OUT_DIR, width: int = WIDTH, height: int = HEIGHT):
+    """
+    Saves the page of a single day and replaces it in the frames file
+    """
+    buffers: Dict[int, Optional[bytes]] = render_pages([page], 1, out_dir)
+    if WRITE_FRAMES:
+        frames.replace_frame(
+            f"{out_dir}/{frames.FILENAME}",
+            page.day_of_month,
+            buffers[page.day_of_month],
+            width,
+            height,
+        )
+    else:
+        remove_frames(out_dir)
+
+
+def remove_frames(out_dir: str = OUT_DIR):
+    """
+    Removes a frames file left from an earlier run.
+    GIFs from the page cache keep their old modification time, so display.py could not tell,
+    that the frames file is older than them.
+    """
+    frames_file: str = f"{out_dir}/{frames.FILENAME}"
+    if os.path.exists(frames_file):
+        os.remove(frames_file)
+
+
+def render_pages(
+    pages: List[Page], jobs: int = 1, out_dir: str = OUT_DIR
+) -> Dict[int, Optional[bytes]]:
+    """
+    Saves the pages from the page cache or renders them with the given number of processes.
+    Returns their buffers by day of month, if a frames file is written.
+    """
+    buffers: Dict[int, Optional[bytes]] = {}
+    keys: Dict[int, str] = {}
+    for page in pages:
+        keys[page.day_of_month] = page_key(page)
+        hit, buffer = PAGE_CACHE.get(
+            keys[page.day_of_month], f"{out_dir}/{page.day_of_month}.gif", WRITE_FRAMES
+        )
+        if hit:
+            buffers[page.day_of_month] = buffer
+    missing: List[Page] = [page for page in pages if page.day_of_month not in buffers]
+    print(f"Page cache: {len(pages) - len(missing)} hits, {len(missing)} misses")
+
+    out_dirs = itertools.repeat(out_dir, len(missing))
+    if jobs > 1 and len(missing) > 1:
+        # The fetches of other profiles and CC-CEDICT may still run in threads, whose locks
+        # would stay locked in forked processes, so the workers are started from a fork server
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("forkserver")
+        ) as executor:
+            rendered = list(executor.map(render_page, missing, out_dirs))
     else:
-        defn = defn.split("\n")[0]
-        defn = defn.replace("• ", "")
-        defn = defn.split("  ")[0]
-        defn = defn.split(",")[0]
-        defn = defn.split(";")[0]
-        defn = defn.split("/")[0]
-        defn = defn.strip()
-    width_defn = FONT_LATIN.getlength(defn)
-    if width_defn > WIDTH:
+        rendered = list(map(render_page, missing, out_dirs))
+    for page, buffer in zip(missing, rendered):
+        PAGE_CACHE.put(keys[page.day_of_month], f"{out_dir}/{page.day_of_month}.gif", buffer)
+        buffers[page.day_of_month] = buffer
+    PAGE_CACHE.flush()
+    return buffers
+
+
+def page_key(page: Page) -> str:
+    """
+    Returns the key of the page in the page cache.
+    It covers everything shown on the page and all settings of how it is drawn.
+    """
+    fonts = []
+    for font in (FONT_CHINESE, FONT_LATIN):
+        stat: os.stat_result = os.stat(font.path)
+        fonts.append((str(font.path), font.size, stat.st_mtime_ns, stat.st_size))
+    settings = [
+        RENDER_VERSION,
+        page.width,
+        page.height,
+        HW_OFFSET,
+        PRON_OFFSET,
+        DEFN_OFFSET,
+        layout.LINE_SPACING,
+        fonts,
+    ]
+    content = [page.hw, page.pron, page.defn, page.pron_fit, page.defn_fit]
+    return hashlib.sha256(json.dumps([settings, content]).encode("utf-8")).hexdigest()
+
+
+def select_pages(
+    cards: Iterable[Card], width: int = WIDTH, height: int = HEIGHT
+) -> List[Page]:
+    """
+    Cleans the flash cards in batches and assigns the usable ones to the days of the month
+    """
+    pages: List[Page] = []
+    cards = iter(cards)
+    while len(pages) < 31:
+        # Only as many cards as pages are missing, so no card is cleaned without being used
+        batch: List[Card] = list(itertools.islice(cards, 31 - len(pages)))
+        if not batch:
+            break
+        for record in NORMALIZER.normalize(batch):
+            metrics.count("cards_considered")
+            fits: Optional[Tuple[layout.Fit, layout.Fit]] = (
+                None if record is None else fit_page(*record, width)
+            )
+            if fits is not None:
+                pages.append(Page(len(pages) + 1, *record, *fits, width, height))
+    return pages
+
+
+def select_daily_page(
+    cards: Iterable[Card],
+    shown: Dict[str, str],
+    today: datetime.date,
+    width: int = WIDTH,
+    height: int = HEIGHT,
+) -> Optional[Page]:
+    """
+    Cleans the flash cards one by one and returns the page of today for the first usable card,
+    which is not in shown. The card is added to shown.
+    """
+    for card in cards:
+        card_key: str = normalize.key(card)
+        if card_key in shown:
+            metrics.count("cards_skipped_shown")
+            continue
+        record: Optional[normalize.Record] = NORMALIZER.normalize([card])[0]
+        metrics.count("cards_considered")
+        fits: Optional[Tuple[layout.Fit, layout.Fit]] = (
+            None if record is None else fit_page(*record, width)
+        )
+        if fits is not None:
+            shown[card_key] = today.isoformat()
+            return Page(today.day, *record, *fits, width, height)
+    return None
+
+
+def fit_page(
+    hw: str, pron: str, defn: str, width: int = WIDTH
+) -> Optional[Tuple[layout.Fit, layout.Fit]]:
+    """
+    Fits pinyin and translation of a cleaned card into the width of a page.
+    Returns None, if they do not fit even in the minimum size.
+    """
+    pron_fit: Optional[layout.Fit] = LAYOUT_LATIN.fit(pron, width)
+    defn_fit: Optional[layout.Fit] = LAYOUT_LATIN.fit(defn, width, DEFN_MAX_LINES)
+    if pron_fit is None or defn_fit is None:
         print("Too long translation", hw, pron, defn)
-        return False
+        metrics.count("cards_skipped_too_long_translation")
+        return None
+    if defn_fit.size < FONT_LATIN.size or len(defn_fit.lines) > 1:
+        metrics.count("cards_fitted")
+    return pron_fit, defn_fit
 
-    # Draw image for each day
-    image: Image = Image.new("1", SIZE, color=1)
-    draw: ImageDraw = ImageDraw.Draw(image)
-    draw_centered_text(CENTER_HEIGHT - 30, hw, FONT_CHINESE, draw)
-    draw_centered_text(CENTER_HEIGHT - 150, pron, FONT_LATIN, draw)
-    draw_centered_text(CENTER_HEIGHT + 150, defn, FONT_LATIN, draw)
-    image.save(f"out/{day_of_month}.gif")
+
+def render_page(page: Page, out_dir: str = OUT_DIR) -> Optional[bytes]:
+    """
+    Draws and saves the image of the page.
+    Returns it in the buffer format of the e-Paper, if a frames file is written.
+    """
+    image: Image.Image = draw_page(page)
+    buffer: Optional[bytes] = save_page(page, image, out_dir)
     image.close()
-    return True
+    return buffer
+
+
+def draw_page(page: Page) -> Image.Image:
+    """
+    Draws the image of the page
+    """
+    image: Image.Image = Image.new("1", (page.width, page.height), color=1)
+    draw: ImageDraw = ImageDraw.Draw(image)
+    center_height: int = int(page.height / 2)
+    draw_centered_glyphs(center_height + HW_OFFSET, page.hw, GLYPHS_CHINESE, image)
+    draw_centered_text(
+        center_height + PRON_OFFSET,
+        page.pron,
+        LAYOUT_LATIN.font(page.pron_fit.size),
+        draw,
+        page.width,
+    )
+    defn_font: ImageFont.FreeTypeFont = LAYOUT_LATIN.font(page.defn_fit.size)
+    for i, line in enumerate(reversed(page.defn_fit.lines)):
+        y: int = center_height + DEFN_OFFSET - i * layout.line_height(page.defn_fit.size)
+        draw_centered_text(y, line, defn_font, draw, page.width)
+    return image
+
+
+def save_page(page: Page, image: Image.Image, out_dir: str = OUT_DIR) -> Optional[bytes]:
+    """
+    Saves the image of the page as GIF.
+    Returns it in the buffer format of the e-Paper, if a frames file is written.
+    """
+    # The GIF may be a hard link into the page cache, so it is replaced instead of overwritten
+    gif_file: str = f"{out_dir}/{page.day_of_month}.gif"
+    image.save(f"{gif_file}.tmp", format="GIF")
+    os.replace(f"{gif_file}.tmp", gif_file)
+    if WRITE_FRAMES:
+        return framebuffer.pack(image, page.width, page.height)
+    return None
 
 
 def draw_centered_text(
-    y: Union[int, float], text: str, font: ImageFont.FreeTypeFont, draw: ImageDraw.ImageDraw
+    y: Union[int, float],
+    text: str,
+    font: ImageFont.FreeTypeFont,
+    draw: ImageDraw.ImageDraw,
+    width: int = WIDTH,
 ):
     """
     Helper function to draw text horizontally centered
     """
     _, _, width_of_text, height_of_text = font.getbbox(text)
-    x_position: int = int((WIDTH - width_of_text) / 2)
+    x_position: int = int((width - width_of_text) / 2)
     y_position: int = int(y - (height_of_text / 2))
     draw.text((x_position, y_position), text, fill=0, font=font)
 
 
-def get_ce_ccdict() -> Dict[str, str]:
-    """
-    Downloads database with translations and cleans the translations
-    """
-    ce_ccdict: Dict[str, str] = {}
-    with requests.get(URL_CC_CEDICT_DATABASE) as r:
-        ce_ccdict_bytes: bytes = gzip.decompress(r.content)
-        for entry_bytes in ce_ccdict_bytes.split(b"\n"):
-            line: str = entry_bytes.decode()
-            if line.startswith("#"):
-                continue
-            # Credits:
-            # https://github.com/rubber-duck-dragon/rubber-duck-dragon.github.io/blob/master/cc-cedict_parser/parser.py
-            line = line.rstrip("/")
-            lines: List[str] = line.split("/")
-            if len(lines) <= 1:
-                continue
-            english: str = lines[1]
-            char_and_pinyin: List[str] = lines[0].split("[")
-            characters: List[str] = char_and_pinyin[0].split()
-            simplified: str = characters[1]
-            if "variant of" in english:
-                continue
-            if english.startswith("used in"):
-                continue
-            if english.startswith("surname"):
-                continue
-            ce_ccdict[simplified] = english
-
-    return ce_ccdict
-
-
-CE_CCDICT: Dict[str, str] = get_ce_ccdict()
-
-main()
+def draw_centered_glyphs(
+    y: Union[int, float], text: str, glyph_cache: glyphs.GlyphCache, image: Image.Image
+):
+    """
+    Helper function to draw text horizontally centered from cached glyphs
+    """
+    _, _, width_of_text, height_of_text = glyph_cache.getbbox(text)
+    x_position: int = int((image.width - width_of_text) / 2)
+    y_position: int = int(y - (height_of_text / 2))
+    glyph_cache.text(image, (x_position, y_position), text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of processes rendering pages"
+    )
+    parser.add_argument(
+        "--profiles", help="JSON file with the profiles of several frames to create pages for"
+    )
+    parser.add_argument(
+        "--daily",
+        action="store_true",
+        help="only create the page of today from the next card not shown yet",
+    )
+    args = parser.parse_args()
+    main(args.jobs, load_profiles(args.profiles) if args.profiles else None, args.daily)
@@ -2,17 +2,206 @@
 """
 Script to display the daily page.
 Link it in /etc/cron.daily to run it daily. Must be run as root to access ePaper display.
+The panel is only refreshed, if the page differs from the one shown last.
+Alternatively, run it with --daemon as a service, which refreshes the panel itself every day
+and shows new pages as soon as they appear in out/.
 """
 
+import argparse
+import contextlib
 import datetime
+import hashlib
+import os
 import pathlib
-from PIL import Image
+import time
+from typing import Iterator, Optional, Tuple
+import frames
+import metrics
 from waveshare_epd import epd7in5
+from waveshare_epd import epdconfig
+from waveshare_epd import framebuffer
 
 folder = pathlib.Path(__file__).parent.resolve()
-image = Image.open(f"{folder}/out/{datetime.datetime.today().day:1d}.gif")
+# Hash of the buffer which has been sent to the panel last
+DISPLAYED_FILE = folder / "cache" / "displayed.sha256"
+METRICS_DIR: str = str(folder / "metrics")
+# Time of the daily refresh in daemon mode
+REFRESH_TIME: datetime.time = datetime.time(0, 1)
+# Seconds between checks of out/ for new pages in daemon mode
+WATCH_INTERVAL: int = 60
 
-epd = epd7in5.EPD()
-epd.init()
-epd.display(epd.getbuffer(image))
-epd.sleep()
+
+def show(buffer, force: bool = False):
+    """
+    Sends the buffer to the panel, unless it is already shown.
+    The panel is only set up for a refresh, so a skipped refresh does not touch SPI or GPIO.
+    """
+    digest: str = hashlib.sha256(buffer).hexdigest()
+    if not force and DISPLAYED_FILE.exists() and DISPLAYED_FILE.read_text() == digest:
+        print("Page already displayed, skipping refresh:", digest)
+        metrics.count("refresh_skipped")
+        return
+    epd = epd7in5.EPD()
+    try:
+        with metrics.stage("epd_init"):
+            epd.init()
+        with metrics.stage("epd_display"):
+            epd.display(buffer)
+    finally:
+        # The panel is powered off and SPI is closed, even if the refresh failed
+        with metrics.stage("epd_sleep"):
+            try:
+                epd.sleep()
+            except Exception:
+                epdconfig.module_exit()
+                raise
+    metrics.count("refreshes")
+    for phase, seconds in epd.busy_times.items():
+        metrics.record(f"busy_{phase}_seconds", seconds)
+    DISPLAYED_FILE.parent.mkdir(parents=True, exist_ok=True)
+    DISPLAYED_FILE.write_text(digest)
+    print("Page displayed:", digest)
+    print(
+        "Busy times:",
+        ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in epd.busy_times.items()),
+    )
+
+
+@contextlib.contextmanager
+def page(day_of_month: int) -> Iterator[bytes]:
+    """
+    Provides the buffer of the page for the day of month from the frames file or the GIF
+    """
+    frames_file = folder / "out" / frames.FILENAME
+    gif_file = folder / "out" / f"{day_of_month:1d}.gif"
+    # Prefer the precompiled frames file, unless the GIF has been created later
+    if frames_file.exists() and (
+        not gif_file.exists() or frames_file.stat().st_mtime >= gif_file.stat().st_mtime
+    ):
+        with frames.FrameReader(str(frames_file)) as month:
+            if (month.width, month.height) != (epd7in5.EPD_WIDTH, epd7in5.EPD_HEIGHT):
+                raise ValueError(
+                    f"Frames file is not made for {epd7in5.EPD_WIDTH}x{epd7in5.EPD_HEIGHT}"
+                )
+            # A month with fewer pages than days has no frame for the last days
+            if day_of_month <= month.days:
+                metrics.count("pages_from_frames")
+                buffer: memoryview = month.frame(day_of_month)
+                try:
+                    yield buffer
+                finally:
+                    # The file can only be unmapped without views into it
+                    buffer.release()
+                return
+    from PIL import Image
+
+    metrics.count("pages_from_gif")
+    with metrics.stage("gif_decode"):
+        gif_buffer: bytes = framebuffer.pack(
+            Image.open(gif_file), epd7in5.EPD_WIDTH, epd7in5.EPD_HEIGHT
+        )
+    yield gif_buffer
+
+
+def main(force: bool = False):
+    """
+    Shows the page of today
+    """
+    with metrics.run("display", METRICS_DIR):
+        with page(datetime.datetime.today().day) as buffer:
+            show(buffer, force)
+
+
+def daemon(force: bool = False):
+    """
+    Keeps running and refreshes the panel every day at REFRESH_TIME.
+    The page for the next refresh is loaded ahead of time and reloaded, if out/ changes.
+    """
+    due: datetime.datetime = next_refresh(datetime.datetime.now())
+    preloaded: Optional[bytes] = None
+    stamp: Optional[Tuple[Tuple[str, int], ...]] = None
+    while True:
+        if datetime.datetime.now() >= due:
+            try:
+                with metrics.run("display", METRICS_DIR):
+                    if preloaded is None:
+                        preloaded = load(due.day)
+                    show(preloaded, force)
+            except (OSError, KeyError, ValueError) as e:
+                print("Refresh failed:", e)
+            due = next_refresh(due)
+            preloaded = None
+
+        new_stamp = out_stamp()
+        if new_stamp != stamp:
+            if stamp is not None:
+                print("Pages in out/ changed")
+            stamp = new_stamp
+            preloaded = None
+            try:
+                with metrics.run("display", METRICS_DIR):
+                    show(load(datetime.datetime.today().day), force)
+            except (OSError, KeyError, ValueError) as e:
+                print("Refresh failed:", e)
+            # Only the first refresh is forced
+            force = False
+
+        if preloaded is None:
+            try:
+                preloaded = load(due.day)
+            except (OSError, KeyError, ValueError) as e:
+                print("Preloading page for", due.date(), "failed:", e)
+
+        seconds_to_refresh: float = (due - datetime.datetime.now()).total_seconds()
+        time.sleep(max(0, min(WATCH_INTERVAL, seconds_to_refresh)))
+
+
+def load(day_of_month: int) -> bytes:
+    """
+    Returns a copy of the buffer of the page for the day of month
+    """
+    with page(day_of_month) as buffer:
+        return bytes(buffer)
+
+
+def next_refresh(after: datetime.datetime) -> datetime.datetime:
+    """
+    Returns the first time of the daily refresh after the given time
+    """
+    refresh: datetime.datetime = datetime.datetime.combine(after.date(), REFRESH_TIME)
+    if refresh <= after:
+        refresh += datetime.timedelta(days=1)
+    return refresh
+
+
+def out_stamp() -> Tuple[Tuple[str, int], ...]:
+    """
+    Returns names and modification times of the files in out/ to detect new pages.
+    Files which are still being written are ignored, a missing out/ has no files.
+    """
+    try:
+        with os.scandir(folder / "out") as entries:
+            return tuple(
+                sorted(
+                    (entry.name, entry.stat().st_mtime_ns)
+                    for entry in entries
+                    if not entry.name.endswith(".tmp")
+                )
+            )
+    except FileNotFoundError:
+        return ()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="refresh the panel even if the page is unchanged"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true", help="keep running and refresh the panel daily"
+    )
+    args = parser.parse_args()
+    if args.daemon:
+        daemon(args.force)
+    else:
+        main(args.force)
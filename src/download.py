@@ -0,0 +1,163 @@
+"""
+Resumable download of large files in parts.
+The parts are fetched with ranged requests in parallel and written directly into a .part file.
+The progress is stored next to it, so an interrupted download continues with the missing parts.
+The result is verified against size and MD5 sum before it is moved into place.
+Failed downloads are retried with retry(), which continues with the missing parts.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Set, Tuple, Type, TypeVar
+import metrics
+
+# Settings
+PART_SIZE: int = 8 * 1024 * 1024
+CONCURRENCY: int = 4
+# Seconds to wait for a connection or the next data of a response
+TIMEOUT: float = 30
+# Attempts of a download and seconds before the first retry, the delay doubles for each retry
+ATTEMPTS: int = 3
+RETRY_DELAY: float = 2
+
+T = TypeVar("T")
+
+# Returns the bytes from start to end (inclusive) in chunks
+FetchRange = Callable[[int, int], Iterable[bytes]]
+
+
+class VerificationError(Exception):
+    """
+    Raised if the downloaded file does not match the expected size or MD5 sum
+    """
+
+
+def download(
+    path: str,
+    size: int,
+    fetch_range: FetchRange,
+    etag: Optional[str] = None,
+    md5: Optional[str] = None,
+    part_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+):
+    """
+    Downloads a file of the given size to path and verifies it against the MD5 sum, if given.
+    A previous partial download is continued, if it has been made for the same ETag and size.
+    Part size and concurrency default to the settings of this module.
+    """
+    part_size = part_size or PART_SIZE
+    concurrency = concurrency or CONCURRENCY
+    part_path: str = f"{path}.part"
+    progress_path: str = f"{path}.part.json"
+    progress = {"etag": etag, "size": size, "part_size": part_size, "done": []}
+    try:
+        with open(progress_path, encoding="utf-8") as f:
+            previous = json.load(f)
+        if all(previous.get(key) == progress[key] for key in ("etag", "size", "part_size")):
+            progress = previous
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    done: Set[int] = set(progress["done"])
+    if not done or not os.path.exists(part_path):
+        done = set()
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    missing: List[int] = [
+        start for start in range(0, size, part_size) if start not in done
+    ]
+    if done:
+        print("Resuming download:", len(done), "parts present,", len(missing), "missing")
+
+    lock = threading.Lock()
+    fd: int = os.open(part_path, os.O_WRONLY)
+    try:
+
+        def fetch_part(start: int):
+            end: int = min(start + part_size, size) - 1
+            offset: int = start
+            for chunk in fetch_range(start, end):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                metrics.count("download_bytes", len(chunk))
+            if offset != end + 1:
+                raise VerificationError(
+                    f"Part at {start} is incomplete: {offset - start} of {end + 1 - start} bytes"
+                )
+            with lock:
+                done.add(start)
+                progress["done"] = sorted(done)
+                with open(progress_path, "w", encoding="utf-8") as f:
+                    json.dump(progress, f)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(fetch_part, start) for start in missing]:
+                future.result()
+    finally:
+        os.close(fd)
+
+    try:
+        verify(part_path, size, md5)
+    except VerificationError:
+        # Start from scratch next time
+        os.unlink(part_path)
+        raise
+    finally:
+        if os.path.exists(progress_path):
+            os.unlink(progress_path)
+    os.replace(part_path, path)
+
+
+def retry(
+    function: Callable[[], T],
+    name: str,
+    exceptions: Tuple[Type[BaseException], ...],
+    attempts: Optional[int] = None,
+    delay: Optional[float] = None,
+) -> T:
+    """
+    Calls the function again after the given exceptions, until it succeeds or all attempts fail.
+    Attempts and delay default to the settings of this module.
+    """
+    attempts = attempts or ATTEMPTS
+    delay = RETRY_DELAY if delay is None else delay
+    for _ in range(attempts - 1):
+        try:
+            return function()
+        except exceptions as e:
+            print(f"Fetching {name} failed, retrying in {delay:g} s:", e)
+            metrics.count(f"{name}_retries")
+            time.sleep(delay)
+            delay *= 2
+    return function()
+
+
+def verify(path: str, size: int, md5: Optional[str] = None):
+    """
+    Checks the size and, if given, the MD5 sum of a file
+    """
+    actual_size: int = os.path.getsize(path)
+    if actual_size != size:
+        raise VerificationError(f"Size of {path} is {actual_size}, expected {size}")
+    if md5 is None:
+        return
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != md5:
+        raise VerificationError(f"MD5 of {path} is {digest.hexdigest()}, expected {md5}")
+
+
+def s3_md5(etag: str) -> Optional[str]:
+    """
+    Returns the MD5 sum of an S3 object from its ETag.
+    Objects uploaded in multiple parts have no MD5 sum as ETag, so None is returned for them.
+    """
+    etag = etag.strip('"')
+    return etag if re.fullmatch("[0-9a-f]{32}", etag) else None
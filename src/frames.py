@@ -0,0 +1,140 @@
+"""
+File with the pages of a month already converted into the buffer format of the e-Paper.
+The daily display job can send a page to the panel without loading PIL or decoding an image.
+
+Layout: a header (magic, version, width, height, number of days, record size) followed by
+one record of fixed size per day, starting with day 1.
+"""
+
+import mmap
+import os
+import struct
+from typing import BinaryIO, Optional, Set
+from waveshare_epd import framebuffer
+
+FILENAME: str = "month.frames"
+MAGIC: bytes = b"HZHF"
+VERSION: int = 1
+HEADER = struct.Struct("<4sHHHHI")
+
+
+def record_size(width: int, height: int) -> int:
+    """
+    Size of one page in the buffer format (4 bits per pixel)
+    """
+    return width // 2 * height
+
+
+class FrameWriter:
+    """
+    Writes the pages of a month into a frames file.
+    The file is written to a temporary path and moved into place on close.
+    Days before the last written day without a page are white, not black as zero bytes.
+    """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.path: str = path
+        self.width: int = width
+        self.height: int = height
+        self.record_size: int = record_size(width, height)
+        self.days: int = 0
+        self._written: Set[int] = set()
+        self._tmp_path: str = f"{path}.tmp"
+        self._file: Optional[BinaryIO] = None
+
+    def __enter__(self) -> "FrameWriter":
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(b"\0" * HEADER.size)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.unlink(self._tmp_path)
+
+    def write(self, day_of_month: int, buffer: bytes):
+        """
+        Writes the buffer of the page for the day of month
+        """
+        if len(buffer) != self.record_size:
+            raise ValueError(
+                f"Unexpected buffer size {len(buffer)}, expected {self.record_size}"
+            )
+        self._file.seek(HEADER.size + (day_of_month - 1) * self.record_size)
+        self._file.write(buffer)
+        self._written.add(day_of_month)
+        self.days = max(self.days, day_of_month)
+
+    def close(self):
+        """
+        Writes the header and moves the file into place
+        """
+        blank: bytes = framebuffer.blank(self.width, self.height)
+        for day_of_month in range(1, self.days + 1):
+            if day_of_month not in self._written:
+                self.write(day_of_month, blank)
+        self._file.truncate(HEADER.size + self.days * self.record_size)
+        self._file.seek(0)
+        self._file.write(
+            HEADER.pack(
+                MAGIC, VERSION, self.width, self.height, self.days, self.record_size
+            )
+        )
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+
+class FrameReader:
+    """
+    Memory maps a frames file and gives access to the page of a day without copying it
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height, self.days, self.record_size = (
+            HEADER.unpack_from(self._mmap)
+        )
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"Unsupported frames file: {path}")
+
+    def __enter__(self) -> "FrameReader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def frame(self, day_of_month: int) -> memoryview:
+        """
+        Returns the buffer of the page for the day of month.
+        The view is only valid until the reader is closed.
+        """
+        if not 1 <= day_of_month <= self.days:
+            raise KeyError(f"No page for day {day_of_month}")
+        offset: int = HEADER.size + (day_of_month - 1) * self.record_size
+        return memoryview(self._mmap)[offset : offset + self.record_size]
+
+    def close(self):
+        """
+        Unmaps the file
+        """
+        self._mmap.close()
+
+
+def replace_frame(path: str, day_of_month: int, buffer: bytes, width: int, height: int):
+    """
+    Replaces the page of one day in a frames file and keeps the other days.
+    The file is created, if it does not exist or is made for another size.
+    """
+    with FrameWriter(path, width, height) as writer:
+        if os.path.exists(path):
+            with FrameReader(path) as reader:
+                if (reader.width, reader.height) == (width, height):
+                    for day in range(1, reader.days + 1):
+                        if day != day_of_month:
+                            with reader.frame(day) as frame:
+                                writer.write(day, frame)
+        writer.write(day_of_month, buffer)
@@ -0,0 +1,143 @@
+"""
+Cache for rendered glyphs of large fonts.
+FreeType only renders a glyph once: the 1 bit bitmap and metrics are stored in a SQLite database
+keyed by font file, size and codepoint, and pages are composed by pasting the cached bitmaps.
+The font file is identified by its path, face index, modification time and size, so glyphs of a
+font, which has been updated, are rendered again.
+This works for scripts without kerning or shaping like Chinese.
+"""
+
+import os
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+CACHE_FILE: str = "cache/glyphs.sqlite"
+
+# Connections inherited from the parent process, which must neither be used nor closed after fork
+_inherited: List[sqlite3.Connection] = []
+
+
+class Glyph(NamedTuple):
+    """
+    Bitmap of a glyph with its bounding box relative to the origin and its advance width
+    """
+
+    bbox: Tuple[int, int, int, int]
+    advance: float
+    bitmap: Image.Image
+
+
+class GlyphCache:
+    """
+    Renders text of one font from cached glyphs
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont, cache_file: str = CACHE_FILE):
+        self.font: ImageFont.FreeTypeFont = font
+        self.cache_file: str = cache_file
+        self._glyphs: Dict[str, Glyph] = {}
+        self._database: Optional[sqlite3.Connection] = None
+        # Process, which opened the database
+        self._pid: Optional[int] = None
+        path: str = str(font.path)
+        stat = os.stat(path)
+        self._path: str = path
+        self._fingerprint: str = "\x1f".join(
+            (path, str(font.index), str(stat.st_mtime_ns), str(stat.st_size))
+        )
+
+    def _open(self) -> sqlite3.Connection:
+        if self._database is not None and self._pid != os.getpid():
+            # Pages are rendered in forked processes, which open their own connection
+            _inherited.append(self._database)
+            self._database = None
+        if self._database is None:
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            self._database = sqlite3.connect(self.cache_file)
+            self._pid = os.getpid()
+            self._database.execute(
+                "create table if not exists glyphs (font text, size integer, "
+                + "codepoint integer, x0 integer, y0 integer, x1 integer, y1 integer, "
+                + "advance real, bitmap blob, primary key (font, size, codepoint))"
+            )
+            # Glyphs of an older version of the font file or keyed by the bare path are stale
+            face: str = f"{self._path}\x1f{self.font.index}\x1f"
+            with self._database:
+                self._database.execute(
+                    "delete from glyphs where font != ? and (font = ? or substr(font, 1, ?) = ?)",
+                    (self._fingerprint, self._path, len(face), face),
+                )
+        return self._database
+
+    def glyph(self, char: str) -> Glyph:
+        """
+        Returns the glyph of a character from memory, the database or FreeType
+        """
+        if char in self._glyphs:
+            return self._glyphs[char]
+        key = (self._fingerprint, self.font.size, ord(char))
+        row = (
+            self._open()
+            .execute(
+                "select x0, y0, x1, y1, advance, bitmap from glyphs "
+                + "where font = ? and size = ? and codepoint = ?",
+                key,
+            )
+            .fetchone()
+        )
+        if row is None:
+            glyph = self._render(char)
+            with self._open() as database:
+                database.execute(
+                    "insert or replace into glyphs values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    key + glyph.bbox + (glyph.advance, glyph.bitmap.tobytes()),
+                )
+        else:
+            x0, y0, x1, y1, advance, bitmap = row
+            glyph = Glyph(
+                (x0, y0, x1, y1),
+                advance,
+                Image.frombytes("1", (x1 - x0, y1 - y0), bitmap),
+            )
+        self._glyphs[char] = glyph
+        return glyph
+
+    def _render(self, char: str) -> Glyph:
+        x0, y0, x1, y1 = self.font.getbbox(char)
+        bitmap: Image.Image = Image.new("1", (x1 - x0, y1 - y0), color=0)
+        ImageDraw.Draw(bitmap).text((-x0, -y0), char, fill=1, font=self.font)
+        return Glyph((x0, y0, x1, y1), self.font.getlength(char), bitmap)
+
+    def getbbox(self, text: str) -> Tuple[int, int, int, int]:
+        """
+        Returns the bounding box of the text like ImageFont.FreeTypeFont.getbbox
+        """
+        x0, y0, x1, y1 = 0, 0, 0, 0
+        pen: float = 0
+        for i, char in enumerate(text):
+            glyph: Glyph = self.glyph(char)
+            gx0, gy0, gx1, gy1 = glyph.bbox
+            origin: int = round(pen)
+            if i == 0:
+                x0, y0, x1, y1 = origin + gx0, gy0, origin + gx1, gy1
+            else:
+                x0, y0 = min(x0, origin + gx0), min(y0, gy0)
+                x1, y1 = max(x1, origin + gx1), max(y1, gy1)
+            pen += glyph.advance
+        return x0, y0, x1, y1
+
+    def text(self, image: Image.Image, xy: Tuple[int, int], text: str, fill: int = 0):
+        """
+        Draws the text like ImageDraw.ImageDraw.text by pasting the cached glyphs
+        """
+        x, y = xy
+        pen: float = 0
+        for char in text:
+            glyph: Glyph = self.glyph(char)
+            gx0, gy0, _, _ = glyph.bbox
+            if glyph.bitmap.width > 0 and glyph.bitmap.height > 0:
+                image.paste(fill, (x + round(pen) + gx0, y + gy0), glyph.bitmap)
+            pen += glyph.advance
@@ -0,0 +1,98 @@
+"""
+Fitting of Latin text into the width of the pages.
+Instead of skipping texts, which are too wide at the default size, the largest font size is picked
+at which the text fits, if allowed wrapped to several lines. Candidates are measured with tables
+of advance widths per size, so FreeType is only asked for the exact width of the chosen layout,
+which includes kerning.
+"""
+
+import string
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from PIL import ImageFont
+
+# Characters, whose advance widths are looked up when the table of a size is created
+PRECOMPUTED: str = string.printable.strip() + " āáǎàēéěèīíǐìōóǒòūúǔùǖǘǚǜüĀÁǍÀĒÉĚÈŌÓǑÒ"
+# Distance between lines relative to the font size
+LINE_SPACING: float = 1.2
+
+
+class Fit(NamedTuple):
+    """
+    Font size and lines of a text, which fits
+    """
+
+    size: int
+    lines: Tuple[str, ...]
+
+
+class TextFitter:
+    """
+    Fits text of one font in sizes from the size of the font down to the minimum size
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont, min_size: int, step: int = 2):
+        self.path: str = str(font.path)
+        self.sizes: List[int] = list(range(font.size, min_size - 1, -step))
+        self._fonts: Dict[int, ImageFont.FreeTypeFont] = {font.size: font}
+        self._advances: Dict[int, Dict[str, float]] = {}
+
+    def font(self, size: int) -> ImageFont.FreeTypeFont:
+        """
+        Returns the font in the given size
+        """
+        if size not in self._fonts:
+            self._fonts[size] = ImageFont.truetype(self.path, size)
+        return self._fonts[size]
+
+    def estimate(self, text: str, size: int) -> float:
+        """
+        Returns the width of the text from the advance widths without kerning
+        """
+        if size not in self._advances:
+            font = self.font(size)
+            self._advances[size] = {char: font.getlength(char) for char in PRECOMPUTED}
+        advances: Dict[str, float] = self._advances[size]
+        width: float = 0
+        for char in text:
+            if char not in advances:
+                advances[char] = self.font(size).getlength(char)
+            width += advances[char]
+        return width
+
+    def fit(self, text: str, width: float, max_lines: int = 1) -> Optional[Fit]:
+        """
+        Returns the largest size and the lines, with which the text fits into the width,
+        or None, if it does not fit even in the minimum size
+        """
+        for size in self.sizes:
+            lines: Optional[List[str]] = self.wrap(text, size, width)
+            if lines is None or len(lines) > max_lines:
+                continue
+            # Kerning can make the exact width differ from the estimate
+            if all(self.font(size).getlength(line) <= width for line in lines):
+                return Fit(size, tuple(lines))
+        return None
+
+    def wrap(self, text: str, size: int, width: float) -> Optional[List[str]]:
+        """
+        Wraps the text at spaces into as few lines of the width as possible.
+        Returns None, if a single word is too wide.
+        """
+        if self.estimate(text, size) <= width:
+            return [text]
+        lines: List[str] = []
+        for word in text.split():
+            if lines and self.estimate(f"{lines[-1]} {word}", size) <= width:
+                lines[-1] = f"{lines[-1]} {word}"
+            elif self.estimate(word, size) <= width:
+                lines.append(word)
+            else:
+                return None
+        return lines
+
+
+def line_height(size: int) -> int:
+    """
+    Returns the distance between lines of the font size
+    """
+    return round(size * LINE_SPACING)
@@ -0,0 +1,120 @@
+"""
+Metrics of a run of create_pages.py or display.py.
+Stages record their duration, counters record e.g. bytes transferred or skipped cards
+and values record single measurements like busy times of the panel.
+A JSON summary of each run is appended to METRICS_DIR/{job}.jsonl and optionally written
+as textfile for the Prometheus node exporter.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+# Settings
+METRICS_DIR: str = "metrics"
+# Directory of the textfile collector of the node exporter, None to not write it
+PROMETHEUS_TEXTFILE_DIR: Optional[str] = None
+
+_lock = threading.Lock()
+_stages: Dict[str, float] = {}
+_counters: Dict[str, float] = {}
+_values: Dict[str, float] = {}
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Measures the duration of a stage, repeated stages are summed up
+    """
+    start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration: float = time.perf_counter() - start
+        with _lock:
+            _stages[name] = _stages.get(name, 0.0) + duration
+
+
+def count(name: str, increment: float = 1):
+    """
+    Increments a counter
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + increment
+
+
+def record(name: str, value: float):
+    """
+    Records a single measurement
+    """
+    with _lock:
+        _values[name] = value
+
+
+@contextlib.contextmanager
+def run(job: str, metrics_dir: str = METRICS_DIR) -> Iterator[None]:
+    """
+    Measures a whole run and writes its summary, also if the run fails
+    """
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _values.clear()
+    started: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+    success: bool = False
+    try:
+        with stage("total"):
+            yield
+        success = True
+    finally:
+        summary: Dict = {
+            "job": job,
+            "started": started.isoformat(),
+            "success": success,
+            "stages": dict(_stages),
+            "counters": dict(_counters),
+            "values": dict(_values),
+        }
+        write_json(summary, metrics_dir)
+        if PROMETHEUS_TEXTFILE_DIR is not None:
+            write_textfile(summary, started, PROMETHEUS_TEXTFILE_DIR)
+
+
+def write_json(summary: Dict, metrics_dir: str):
+    """
+    Appends the summary of the run to the history of the job
+    """
+    os.makedirs(metrics_dir, exist_ok=True)
+    with open(os.path.join(metrics_dir, f"{summary['job']}.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(summary) + "\n")
+
+
+def write_textfile(summary: Dict, started: datetime.datetime, textfile_dir: str):
+    """
+    Writes the summary in the text format of Prometheus for the node exporter
+    """
+    job: str = summary["job"]
+    lines = [
+        "# TYPE hanzihua_last_run_timestamp_seconds gauge",
+        f'hanzihua_last_run_timestamp_seconds{{job="{job}"}} {started.timestamp()}',
+        "# TYPE hanzihua_last_run_success gauge",
+        f'hanzihua_last_run_success{{job="{job}"}} {int(summary["success"])}',
+        "# TYPE hanzihua_stage_duration_seconds gauge",
+    ]
+    for name, value in summary["stages"].items():
+        lines.append(f'hanzihua_stage_duration_seconds{{job="{job}",stage="{name}"}} {value}')
+    lines.append("# TYPE hanzihua_run_count gauge")
+    for name, value in summary["counters"].items():
+        lines.append(f'hanzihua_run_count{{job="{job}",name="{name}"}} {value}')
+    lines.append("# TYPE hanzihua_run_value gauge")
+    for name, value in summary["values"].items():
+        lines.append(f'hanzihua_run_value{{job="{job}",name="{name}"}} {value}')
+    # The node exporter must not read a partially written file
+    path: str = os.path.join(textfile_dir, f"hanzihua_{job}.prom")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(f"{path}.tmp", path)
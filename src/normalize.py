@@ -0,0 +1,132 @@
+"""
+Normalization of flash cards for the pages.
+Headword, pinyin and definition are cleaned in batches. Converting the pinyin is relatively slow
+and the deck hardly changes between months, so the cleaned cards are memoized in a SQLite
+database keyed by the raw card. Missing definitions are looked up in CC-CEDICT afterwards,
+so the memoized results stay valid, if the dictionary is updated.
+"""
+
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from dragonmapper import transcriptions
+import cedict
+import metrics
+
+# Settings
+CACHE_FILE: str = "cache/normalize.sqlite"
+# Longest Chinese words shown, longer ones are skipped
+MAX_HW_LENGTH: int = 3
+# Increase, if the cleanup is changed, to discard the memoized results
+VERSION: int = 1
+# Cards looked up in the database with one query
+LOOKUP_SIZE: int = 500
+
+# Flash card as stored in the database: hw=Chinese pron=Pronunciation, defn=Definition
+Card = Tuple[str, str, Optional[str]]
+# Flash card as shown on a page
+Record = Tuple[str, str, str]
+
+
+def clean(hw: str, pron: str, defn: Optional[str]) -> Tuple[str, str, Optional[str]]:
+    """
+    Cleans a flash card, a missing definition stays None
+    """
+    hw = hw.replace("@", "")
+    pron = pron.replace("@", "")
+    pron = pron.replace("/", "")
+    pron = transcriptions.numbered_to_accented(pron)
+    if defn is not None:
+        defn = defn.split("\n")[0]
+        defn = defn.replace("• ", "")
+        defn = defn.split("  ")[0]
+        defn = defn.split(",")[0]
+        defn = defn.split(";")[0]
+        defn = defn.split("/")[0]
+        defn = defn.strip()
+    return hw, pron, defn
+
+
+class Normalizer:
+    """
+    Cleans flash cards with memoized results
+    """
+
+    def __init__(self, cache_file: str = CACHE_FILE):
+        self.cache_file: str = cache_file
+        self._memo: Dict[Card, Tuple[str, str, Optional[str]]] = {}
+        self._database: Optional[sqlite3.Connection] = None
+
+    def _open(self) -> sqlite3.Connection:
+        if self._database is None:
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            self._database = sqlite3.connect(self.cache_file)
+            if self._database.execute("pragma user_version").fetchone()[0] != VERSION:
+                self._database.execute("drop table if exists cards")
+                self._database.execute(f"pragma user_version = {VERSION}")
+            self._database.execute(
+                "create table if not exists cards "
+                + "(card text primary key, hw text, pron text, defn text)"
+            )
+        return self._database
+
+    def normalize(self, cards: Iterable[Card]) -> List[Optional[Record]]:
+        """
+        Returns the cards as shown on a page in the same order.
+        Cards, which can not be shown, are returned as None.
+        """
+        cards = [tuple(card) for card in cards]
+        self._memoize(
+            [card for card in cards if len(card[0].replace("@", "")) <= MAX_HW_LENGTH]
+        )
+        records: List[Optional[Record]] = []
+        for card in cards:
+            if card not in self._memo:
+                print("Too long Chinese:", card[0])
+                metrics.count("cards_skipped_too_long_chinese")
+                records.append(None)
+                continue
+            hw, pron, defn = self._memo[card]
+            if defn is None:
+                defn = cedict.lookup(hw)
+                if defn is None:
+                    print("No Translation:", hw, pron)
+                    metrics.count("cards_skipped_no_translation")
+                    records.append(None)
+                    continue
+                defn = defn.split(";")[0]
+            records.append((hw, pron, defn))
+        return records
+
+    def _memoize(self, cards: Sequence[Card]):
+        """
+        Memoizes the cleaned cards from the database or clean()
+        """
+        missing: Dict[str, Card] = {
+            key(card): card for card in cards if card not in self._memo
+        }
+        keys: List[str] = list(missing)
+        for start in range(0, len(keys), LOOKUP_SIZE):
+            part: List[str] = keys[start : start + LOOKUP_SIZE]
+            for card_key, hw, pron, defn in self._open().execute(
+                "select card, hw, pron, defn from cards "
+                + f"where card in ({', '.join('?' * len(part))})",
+                part,
+            ):
+                self._memo[missing.pop(card_key)] = (hw, pron, defn)
+        new: List[Tuple[str, str, str, Optional[str]]] = []
+        for card_key, card in missing.items():
+            self._memo[card] = clean(*card)
+            new.append((card_key, *self._memo[card]))
+        metrics.count("cards_normalized", len(new))
+        if new:
+            with self._open() as database:
+                database.executemany("insert or replace into cards values (?, ?, ?, ?)", new)
+
+
+def key(card: Card) -> str:
+    """
+    Returns the key of a raw card in the database, missing definitions are distinguished
+    from empty ones by the number of fields
+    """
+    return "\x1f".join(field for field in card if field is not None)
@@ -0,0 +1,148 @@
+"""
+Cache of rendered pages.
+Pages are stored by a key, which is a hash of their content and everything affecting how they are
+drawn. A page rendered in an earlier month is hard-linked into place instead of being drawn again.
+The least recently used pages are evicted, if the cache grows beyond its maximum size.
+Changes of the index are collected and written in one transaction by flush() at the end of a run,
+as a commit per page costs more than rendering the page.
+"""
+
+import os
+import shutil
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+import metrics
+
+# Settings
+CACHE_DIR: str = "cache/pages"
+MAX_BYTES: int = 64 * 1024 * 1024
+
+
+class PageCache:
+    """
+    Cache of GIFs and frame buffers of rendered pages with LRU eviction
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+        self._database: Optional[sqlite3.Connection] = None
+        # Pending changes of the index: use times of hits and sizes of added pages by key
+        self._used: Dict[str, float] = {}
+        self._added: Dict[str, int] = {}
+
+    def _open(self) -> sqlite3.Connection:
+        if self._database is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._database = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"))
+            self._database.execute(
+                "create table if not exists pages "
+                + "(key text primary key, bytes integer not null, used real not null)"
+            )
+        return self._database
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{suffix}")
+
+    def get(self, key: str, gif_file: str, with_frame: bool) -> Tuple[bool, Optional[bytes]]:
+        """
+        Places the cached GIF of the page at gif_file.
+        Returns, if the page is cached, and its frame buffer, if requested.
+        The use time is written to the index by flush().
+        """
+        database: sqlite3.Connection = self._open()
+        frame: Optional[bytes] = None
+        try:
+            if (
+                key not in self._added
+                and database.execute("select 1 from pages where key = ?", (key,)).fetchone()
+                is None
+            ):
+                raise FileNotFoundError(key)
+            if with_frame:
+                with open(self._path(key, "frame"), "rb") as f:
+                    frame = f.read()
+            place(self._path(key, "gif"), gif_file)
+        except FileNotFoundError:
+            metrics.count("page_cache_misses")
+            return False, None
+        self._used[key] = time.time()
+        metrics.count("page_cache_hits")
+        return True, frame
+
+    def put(self, key: str, gif_file: str, frame: Optional[bytes]):
+        """
+        Adds the rendered page, it is written to the index by flush()
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        place(gif_file, self._path(key, "gif"))
+        size: int = os.path.getsize(gif_file)
+        if frame is not None:
+            with open(f"{self._path(key, 'frame')}.tmp", "wb") as f:
+                f.write(frame)
+            os.replace(f"{self._path(key, 'frame')}.tmp", self._path(key, "frame"))
+            size += len(frame)
+        self._added[key] = size
+        self._used[key] = time.time()
+
+    def flush(self):
+        """
+        Writes the pending changes to the index in one transaction
+        and evicts the least recently used pages, if the cache is full
+        """
+        database: sqlite3.Connection = self._open()
+        with database:
+            database.executemany(
+                "insert or replace into pages values (?, ?, ?)",
+                [(key, size, self._used[key]) for key, size in self._added.items()],
+            )
+            database.executemany(
+                "update pages set used = ? where key = ?",
+                [(used, key) for key, used in self._used.items() if key not in self._added],
+            )
+        self._added.clear()
+        self._used.clear()
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used pages until the cache is not larger than max_bytes
+        """
+        database: sqlite3.Connection = self._open()
+        (total,) = database.execute("select ifnull(sum(bytes), 0) from pages").fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted: List[str] = []
+        for key, size in database.execute("select key, bytes from pages order by used").fetchall():
+            for suffix in ("gif", "frame"):
+                with_suffix: str = self._path(key, suffix)
+                if os.path.exists(with_suffix):
+                    os.remove(with_suffix)
+            evicted.append(key)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        with database:
+            database.executemany("delete from pages where key = ?", [(key,) for key in evicted])
+        metrics.count("page_cache_evictions", len(evicted))
+
+
+def place(source: str, destination: str):
+    """
+    Hard-links the source to the destination or copies it, if the file system can not link it.
+    The destination is replaced atomically, so other links to a replaced file are not changed.
+    """
+    # Renaming a link onto another link of the same file does nothing and leaves the link behind
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    tmp: str = f"{destination}.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, destination)
@@ -0,0 +1,195 @@
+"""
+Local copy of the Pleco flash card database.
+The database is only downloaded again, if the backup has been changed since the last run.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, Optional
+import requests
+import boto3
+import botocore.config
+import botocore.exceptions
+import config
+import download
+import metrics
+
+# Settings
+DATABASE_FILE: str = "cache/flashbackup.pqb"
+# Download the database from this URL instead of the S3 bucket configured in config
+URL_PLECO_FLASHCARD_DATABASE: Optional[str] = None
+CHUNK_SIZE: int = 64 * 1024
+
+# Errors of a sync, after which it is retried
+FETCH_ERRORS = (
+    requests.RequestException,
+    botocore.exceptions.BotoCoreError,
+    botocore.exceptions.ClientError,
+    download.VerificationError,
+)
+
+
+def sync_database(database_file: str = DATABASE_FILE, prefix: Optional[str] = None) -> str:
+    """
+    Updates the local copy of the database from the configured source and returns its path.
+    In the bucket, the latest backup with the prefix is used, by default with config.PREFIX.
+    A failed sync is retried and continues an interrupted download.
+    """
+    os.makedirs(os.path.dirname(database_file) or ".", exist_ok=True)
+    state: Dict[str, str] = load_state(database_file)
+    if not os.path.exists(database_file):
+        state = {}
+    if URL_PLECO_FLASHCARD_DATABASE is not None:
+        state = download.retry(
+            lambda: sync_from_url(database_file, state), "database", FETCH_ERRORS
+        )
+    else:
+        state = download.retry(
+            lambda: sync_from_s3(database_file, state, prefix or config.PREFIX),
+            "database",
+            FETCH_ERRORS,
+        )
+    save_state(database_file, state)
+    return database_file
+
+
+def sync_from_s3(database_file: str, state: Dict[str, str], prefix: str) -> Dict[str, str]:
+    """
+    Downloads the latest backup in the bucket, if its key or ETag differs from the local copy
+    """
+    # Sessions are not thread safe, databases of several frames are synced concurrently
+    s3 = boto3.session.Session().client(
+        "s3",
+        region_name=config.REGION,
+        config=botocore.config.Config(
+            connect_timeout=download.TIMEOUT, read_timeout=download.TIMEOUT
+        ),
+    )
+    latest_database: Optional[Dict] = None
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=config.BUCKET, Prefix=prefix):
+        for database in page.get("Contents", []):
+            if latest_database is None or database["Key"] > latest_database["Key"]:
+                latest_database = database
+    if latest_database is None:
+        raise RuntimeError(f"No database found in s3://{config.BUCKET}/{prefix}")
+    print("Latest database:", latest_database["Key"])
+
+    if (
+        state.get("key") == latest_database["Key"]
+        and state.get("etag") == latest_database["ETag"]
+    ):
+        print("Database unchanged")
+        metrics.record("database_changed", 0)
+        return state
+    metrics.record("database_changed", 1)
+
+    def fetch_range(start: int, end: int) -> Iterable[bytes]:
+        response = s3.get_object(
+            Bucket=config.BUCKET,
+            Key=latest_database["Key"],
+            Range=f"bytes={start}-{end}",
+            IfMatch=latest_database["ETag"],
+        )
+        return response["Body"].iter_chunks(chunk_size=CHUNK_SIZE)
+
+    download.download(
+        database_file,
+        latest_database["Size"],
+        fetch_range,
+        etag=latest_database["ETag"],
+        md5=download.s3_md5(latest_database["ETag"]),
+    )
+    return {"key": latest_database["Key"], "etag": latest_database["ETag"]}
+
+
+def sync_from_url(database_file: str, state: Dict[str, str]) -> Dict[str, str]:
+    """
+    Checks with a conditional request, if the database has been changed, and downloads it.
+    The download is done in parts, if the server supports ranged requests.
+    """
+    headers: Dict[str, str] = {}
+    if "etag" in state:
+        headers["If-None-Match"] = state["etag"]
+    if "last-modified" in state:
+        headers["If-Modified-Since"] = state["last-modified"]
+    with requests.head(
+        URL_PLECO_FLASHCARD_DATABASE,
+        headers=headers,
+        allow_redirects=True,
+        timeout=download.TIMEOUT,
+    ) as r:
+        if r.status_code == 304:
+            print("Database unchanged")
+            metrics.record("database_changed", 0)
+            return state
+        r.raise_for_status()
+        metrics.record("database_changed", 1)
+        validators: Dict[str, str] = {
+            key: r.headers[key] for key in ("etag", "last-modified") if key in r.headers
+        }
+        size: int = int(r.headers["content-length"])
+        supports_ranges: bool = r.headers.get("accept-ranges") == "bytes"
+
+    # Make sure that all parts are from the same version of the file
+    if_range: Optional[str] = validators.get("etag", "")
+    if not if_range or if_range.startswith("W/"):
+        if_range = validators.get("last-modified")
+
+    def fetch_range(start: int, end: int) -> Iterable[bytes]:
+        range_headers: Dict[str, str] = {}
+        if supports_ranges:
+            range_headers["Range"] = f"bytes={start}-{end}"
+            if if_range is not None:
+                range_headers["If-Range"] = if_range
+        with requests.get(
+            URL_PLECO_FLASHCARD_DATABASE,
+            headers=range_headers,
+            stream=True,
+            timeout=download.TIMEOUT,
+        ) as r:
+            r.raise_for_status()
+            if supports_ranges and r.status_code != 206:
+                raise download.VerificationError("Database changed during download")
+            yield from r.iter_content(chunk_size=CHUNK_SIZE)
+
+    if supports_ranges:
+        download.download(
+            database_file, size, fetch_range, etag=validators.get("etag")
+        )
+    else:
+        download.download(
+            database_file,
+            size,
+            fetch_range,
+            etag=validators.get("etag"),
+            part_size=max(size, 1),
+            concurrency=1,
+        )
+    return validators
+
+
+def state_file(database_file: str) -> str:
+    """
+    Returns the path of the file with the key and ETag of the local copy
+    """
+    return f"{os.path.splitext(database_file)[0]}.json"
+
+
+def load_state(database_file: str) -> Dict[str, str]:
+    """
+    Returns the key and ETag of the local copy
+    """
+    try:
+        with open(state_file(database_file), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(database_file: str, state: Dict[str, str]):
+    """
+    Stores the key and ETag of the local copy
+    """
+    with open(state_file(database_file), "w", encoding="utf-8") as f:
+        json.dump(state, f)
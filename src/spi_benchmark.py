@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+"""
+Script to measure the upload of a frame to the ePaper display with different SPI settings.
+Must be run as root to access ePaper display. The panel is not refreshed.
+Use the fastest settings, which work reliably, with the EPD_SPI_* environment variables.
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List
+from waveshare_epd import epd7in5
+from waveshare_epd import epdconfig
+from waveshare_epd import framebuffer
+
+
+def benchmark(
+    speeds: List[int], chunk_sizes: List[int], buffer_types: List[str], repeat: int
+) -> List[Dict]:
+    """
+    Uploads a white frame with each combination of settings and returns the timings
+    """
+    epd = epd7in5.EPD()
+    frame: bytes = framebuffer.blank(epd.width, epd.height)
+    results: List[Dict] = []
+    epd.init()
+    try:
+        for speed_hz in speeds:
+            for chunk_size in chunk_sizes:
+                for buffer_type in buffer_types:
+                    epdconfig.spi_config(speed_hz, chunk_size, buffer_type)
+                    latencies: List[float] = []
+                    for _ in range(repeat):
+                        start: float = time.perf_counter()
+                        epd.send_command(0x10)
+                        epd.send_data2(frame)
+                        latencies.append(time.perf_counter() - start)
+                    result: Dict = {
+                        "speed_hz": speed_hz,
+                        "chunk_size": chunk_size,
+                        "buffer_type": buffer_type,
+                        "latency_s": min(latencies),
+                        "bytes_per_s": len(frame) / min(latencies),
+                    }
+                    print(
+                        f"{speed_hz:>10} Hz {chunk_size:>7} B {buffer_type:>10}: "
+                        + f"{result['latency_s'] * 1000:8.1f} ms {result['bytes_per_s'] / 1000:8.1f} kB/s"
+                    )
+                    results.append(result)
+    finally:
+        epd.sleep()
+    return results
+
+
+def int_list(value: str) -> List[int]:
+    """
+    Parses a comma separated list of numbers
+    """
+    return [int(item) for item in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--speeds",
+        type=int_list,
+        default=[2000000, 4000000, 8000000, 16000000],
+        help="SPI clocks in Hz",
+    )
+    parser.add_argument(
+        "--chunk-sizes",
+        type=int_list,
+        default=[0, 4096, 32768],
+        help="bytes per write call, 0 for the whole frame",
+    )
+    parser.add_argument(
+        "--buffer-types",
+        type=lambda value: value.split(","),
+        default=["list", "bytes", "memoryview"],
+        help="types the frame is passed as",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="uploads per setting")
+    parser.add_argument(
+        "--output", default="spi_benchmark.json", help="file to save the results to"
+    )
+    args = parser.parse_args()
+    benchmark_results = benchmark(
+        args.speeds, args.chunk_sizes, args.buffer_types, args.repeat
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(benchmark_results, f, indent=2)
+    print("Results saved to", args.output)
@@ -0,0 +1,259 @@
+"""
+Tests of the resumable download and the sync of the Pleco database against a local HTTP server
+and a moto stand-in for S3.
+"""
+
+import hashlib
+import http.server
+import json
+import os
+import re
+import sys
+import threading
+import types
+from typing import Dict, Iterable, Iterator, List, Optional
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import config
+except ImportError:
+    # config.py is written by the user and not needed apart from the names set in the tests
+    config = types.ModuleType("config")
+    sys.modules["config"] = config
+import download  # noqa: E402
+import pleco  # noqa: E402
+
+PAYLOAD: bytes = bytes(range(256)) * 40
+CHANGED_PAYLOAD: bytes = bytes(reversed(range(256))) * 40
+
+
+class DatabaseServer(http.server.ThreadingHTTPServer):
+    """
+    Serves one file with ETag, conditional and ranged requests
+    """
+
+    def __init__(self, ranges: bool = True):
+        super().__init__(("127.0.0.1", 0), DatabaseHandler)
+        self.payload: bytes = PAYLOAD
+        self.ranges: bool = ranges
+        # Payload, which replaces the file after the next HEAD request
+        self.change_after_head: Optional[bytes] = None
+        self.gets: List[Dict[str, str]] = []
+
+    @property
+    def etag(self) -> str:
+        return f'"{hashlib.md5(self.payload).hexdigest()}"'
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/flashbackup.pqb"
+
+
+class DatabaseHandler(http.server.BaseHTTPRequestHandler):
+    server: DatabaseServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        etag: str = self.server.etag
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.payload)))
+        self.send_header("ETag", etag)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if self.server.change_after_head is not None:
+            self.server.payload, self.server.change_after_head = (
+                self.server.change_after_head,
+                None,
+            )
+
+    def do_GET(self):
+        self.server.gets.append(dict(self.headers))
+        payload: bytes = self.server.payload
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if_range: Optional[str] = self.headers.get("If-Range")
+        if self.server.ranges and match and if_range in (None, self.server.etag):
+            start, end = int(match[1]), int(match[2])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+            payload = payload[start : end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", self.server.etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(download, "RETRY_DELAY", 0)
+
+
+@pytest.fixture
+def server(monkeypatch) -> Iterator[DatabaseServer]:
+    database_server = DatabaseServer()
+    thread = threading.Thread(target=database_server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(pleco, "URL_PLECO_FLASHCARD_DATABASE", database_server.url)
+    yield database_server
+    database_server.shutdown()
+    database_server.server_close()
+
+
+def ranges_of(payload: bytes, failing: Optional[int] = None):
+    """
+    Returns a FetchRange of the payload, which records the fetched parts
+    and fails once at the given start
+    """
+    fetched: List[int] = []
+    failed: List[int] = []
+
+    def fetch_range(start: int, end: int) -> Iterable[bytes]:
+        if start == failing and not failed:
+            failed.append(start)
+            raise ConnectionError(f"Part at {start} failed")
+        fetched.append(start)
+        return [payload[start : end + 1]]
+
+    return fetch_range, fetched
+
+
+def test_download_resumes_missing_parts(tmp_path):
+    path: str = str(tmp_path / "file")
+    fetch_range, fetched = ranges_of(PAYLOAD, failing=2048)
+    with pytest.raises(ConnectionError):
+        download.download(path, len(PAYLOAD), fetch_range, "etag", part_size=1024, concurrency=1)
+    assert not os.path.exists(path)
+    with open(f"{path}.part.json", encoding="utf-8") as f:
+        assert 2048 not in json.load(f)["done"]
+
+    fetched.clear()
+    download.download(
+        path,
+        len(PAYLOAD),
+        fetch_range,
+        "etag",
+        md5=hashlib.md5(PAYLOAD).hexdigest(),
+        part_size=1024,
+    )
+    assert fetched == [2048]
+    with open(path, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert not os.path.exists(f"{path}.part")
+    assert not os.path.exists(f"{path}.part.json")
+
+
+def test_download_of_another_version_starts_over(tmp_path):
+    path: str = str(tmp_path / "file")
+    fetch_range, fetched = ranges_of(PAYLOAD, failing=2048)
+    with pytest.raises(ConnectionError):
+        download.download(path, len(PAYLOAD), fetch_range, "old", part_size=1024, concurrency=1)
+    fetched.clear()
+    download.download(path, len(PAYLOAD), fetch_range, "new", part_size=1024)
+    assert sorted(fetched) == list(range(0, len(PAYLOAD), 1024))
+
+
+def test_download_rejects_wrong_md5(tmp_path):
+    path: str = str(tmp_path / "file")
+    fetch_range, _ = ranges_of(PAYLOAD)
+    with pytest.raises(download.VerificationError):
+        download.download(
+            path, len(PAYLOAD), fetch_range, md5=hashlib.md5(b"other").hexdigest()
+        )
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.part")
+
+
+def test_download_rejects_incomplete_part(tmp_path):
+    path: str = str(tmp_path / "file")
+    fetch_range, _ = ranges_of(PAYLOAD[:-1])
+    with pytest.raises(download.VerificationError):
+        download.download(path, len(PAYLOAD), fetch_range, part_size=1024)
+    assert not os.path.exists(path)
+
+
+def test_s3_md5():
+    assert download.s3_md5('"0123456789abcdef0123456789abcdef"') == (
+        "0123456789abcdef0123456789abcdef"
+    )
+    assert download.s3_md5('"0123456789abcdef0123456789abcdef-3"') is None
+
+
+def test_sync_from_url_in_ranges(tmp_path, monkeypatch, server):
+    monkeypatch.setattr(download, "PART_SIZE", 1024)
+    database_file: str = str(tmp_path / "flashbackup.pqb")
+    pleco.sync_database(database_file)
+    with open(database_file, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert len(server.gets) == len(range(0, len(PAYLOAD), 1024))
+    assert all(get["If-Range"] == server.etag for get in server.gets)
+
+    # Unchanged on the server, so only the conditional HEAD request is made
+    server.gets.clear()
+    pleco.sync_database(database_file)
+    assert server.gets == []
+
+
+def test_sync_from_url_changed_during_download(tmp_path, monkeypatch, capsys, server):
+    monkeypatch.setattr(download, "PART_SIZE", 1024)
+    server.change_after_head = CHANGED_PAYLOAD
+    database_file: str = str(tmp_path / "flashbackup.pqb")
+    # The parts of the first attempt are refused by If-Range, the retry gets the new version
+    pleco.sync_database(database_file)
+    assert "Database changed during download" in capsys.readouterr().out
+    with open(database_file, "rb") as f:
+        assert f.read() == CHANGED_PAYLOAD
+    assert pleco.load_state(database_file)["etag"] == server.etag
+
+
+def test_sync_from_url_without_ranges(tmp_path, server):
+    server.ranges = False
+    database_file: str = str(tmp_path / "flashbackup.pqb")
+    pleco.sync_database(database_file)
+    with open(database_file, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert len(server.gets) == 1
+    assert "Range" not in server.gets[0]
+
+
+def test_sync_from_s3(tmp_path, monkeypatch, capsys):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(config, "REGION", "eu-west-1", raising=False)
+    monkeypatch.setattr(config, "BUCKET", "backups", raising=False)
+    monkeypatch.setattr(config, "PREFIX", "pleco/", raising=False)
+    monkeypatch.setattr(pleco, "URL_PLECO_FLASHCARD_DATABASE", None)
+    monkeypatch.setattr(download, "PART_SIZE", 1024)
+    database_file: str = str(tmp_path / "flashbackup.pqb")
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name=config.REGION)
+        s3.create_bucket(
+            Bucket=config.BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": config.REGION},
+        )
+        s3.put_object(Bucket=config.BUCKET, Key="pleco/2026-01-01.pqb", Body=CHANGED_PAYLOAD)
+        s3.put_object(Bucket=config.BUCKET, Key="pleco/2026-01-02.pqb", Body=PAYLOAD)
+        s3.put_object(Bucket=config.BUCKET, Key="other/2026-01-03.pqb", Body=CHANGED_PAYLOAD)
+
+        pleco.sync_database(database_file)
+        with open(database_file, "rb") as f:
+            assert f.read() == PAYLOAD
+        assert pleco.load_state(database_file)["key"] == "pleco/2026-01-02.pqb"
+
+        capsys.readouterr()
+        pleco.sync_database(database_file)
+        assert "Database unchanged" in capsys.readouterr().out
+
+        pleco.sync_database(database_file, "other/")
+        with open(database_file, "rb") as f:
+            assert f.read() == CHANGED_PAYLOAD
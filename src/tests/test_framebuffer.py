@@ -0,0 +1,79 @@
+"""
+Tests of the conversion of images into the buffer format of the e-Paper against the per-pixel
+loop of the original EPD.getbuffer.
+"""
+
+import os
+import random
+import sys
+from typing import List
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from waveshare_epd import framebuffer  # noqa: E402
+
+WIDTH: int = 640
+HEIGHT: int = 384
+
+
+def reference_pack(image, width: int, height: int) -> List[int]:
+    """
+    Per-pixel loop of EPD.getbuffer before it was replaced by framebuffer.pack
+    """
+    imwidth, imheight = image.size
+    halfwidth = int(width / 2)
+    buf = [0x33] * halfwidth * height
+    if imwidth == width and imheight == height:
+        image = image.convert("1")
+    elif imwidth == height and imheight == width:
+        image = image.rotate(90, expand=True).convert("1")
+        imwidth, imheight = image.size
+    else:
+        return buf
+    pixels = image.load()
+    for y in range(imheight):
+        offset = y * halfwidth
+        for x in range(1, imwidth, 2):
+            i = offset + x // 2
+            if pixels[x - 1, y] > 191:
+                buf[i] = 0x33 if pixels[x, y] > 191 else 0x30
+            else:
+                buf[i] = 0x03 if pixels[x, y] > 191 else 0x00
+    return buf
+
+
+def random_image(mode: str, size, seed: int) -> Image.Image:
+    """
+    Returns an image of random pixels in the given mode
+    """
+    generator = random.Random(seed)
+    channels: int = len(Image.new(mode, (1, 1)).getbands())
+    data: bytes = bytes(generator.randrange(256) for _ in range(size[0] * size[1] * channels))
+    if mode == "1":
+        return Image.frombytes("L", size, data).convert("1")
+    return Image.frombytes(mode, size, data)
+
+
+@pytest.mark.parametrize("mode", ["1", "L", "RGB"])
+@pytest.mark.parametrize("size", [(WIDTH, HEIGHT), (HEIGHT, WIDTH)])
+def test_pack_matches_reference(mode: str, size):
+    image: Image.Image = random_image(mode, size, seed=size[0] + len(mode))
+    assert framebuffer.pack(image, WIDTH, HEIGHT) == bytes(
+        reference_pack(image, WIDTH, HEIGHT)
+    )
+
+
+@pytest.mark.parametrize("size", [(122, 250), (250, 122), (300, 400), (800, 480)])
+def test_pack_other_panels_matches_reference(size):
+    width, height = size
+    image: Image.Image = random_image("L", size, seed=width)
+    assert framebuffer.pack(image, width, height) == bytes(
+        reference_pack(image, width, height)
+    )
+
+
+def test_pack_wrong_size_is_blank():
+    image: Image.Image = random_image("L", (WIDTH, WIDTH), seed=1)
+    assert framebuffer.pack(image, WIDTH, HEIGHT) == bytes(reference_pack(image, WIDTH, HEIGHT))
+    assert framebuffer.pack(image, WIDTH, HEIGHT) == framebuffer.blank(WIDTH, HEIGHT)
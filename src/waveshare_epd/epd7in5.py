@@ -29,11 +29,15 @@
 
 
 import logging
+import time
 from . import epdconfig
+from . import framebuffer
 
 # Display resolution
 EPD_WIDTH       = 640
 EPD_HEIGHT      = 384
+# Maximum time to wait for the BUSY pin
+BUSY_TIMEOUT_MS = 30000
 
 class EPD:
     def __init__(self):
@@ -43,6 +47,9 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.busy_timeout_ms = BUSY_TIMEOUT_MS
+        # Seconds the panel has been busy per phase of the last run
+        self.busy_times = {}
     
     # Hardware reset
     def reset(self):
@@ -71,11 +78,13 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
-    def ReadBusy(self):
+    def ReadBusy(self, phase="busy"):
         logging.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)    
-        logging.debug("e-Paper busy release")
+        start = time.monotonic()
+        if not epdconfig.wait_digital(self.busy_pin, 1, self.busy_timeout_ms):      # 0: busy, 1: idle
+            raise TimeoutError("e-Paper busy for more than %d ms (%s)" % (self.busy_timeout_ms, phase))
+        self.busy_times[phase] = time.monotonic() - start
+        logging.debug("e-Paper busy release after %.3f s (%s)" % (self.busy_times[phase], phase))
         
     def init(self):
         if (epdconfig.module_init() != 0):
@@ -93,7 +102,7 @@ class EPD:
         self.send_data2([0xc7, 0xcc, 0x28])
         
         self.send_command(0x04) # POWER_ON
-        self.ReadBusy()
+        self.ReadBusy("power_on")
         
         self.send_command(0x30) # PLL_CONTROL
         self.send_data(0x3c)
@@ -123,56 +132,25 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        halfwidth = int(self.width / 2)
-        buf = [0x33] * halfwidth * self.height
-        
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            img = img.rotate(90, expand=True).convert('1')
-            imwidth, imheight = img.size
-        else:
-            logging.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
-            # return a blank buffer
-            return buf
-        
-        pixels = img.load()
-
-        for y in range(imheight):
-            offset = y * halfwidth
-            for x in range(1, imwidth, 2):
-                i = offset + x // 2
-                if(pixels[x-1, y] > 191):
-                    if(pixels[x, y] > 191):
-                        buf[i] = 0x33
-                    else:
-                        buf[i] = 0x30
-                else:
-                    if(pixels[x, y] > 191):
-                        buf[i] = 0x03
-                    else:
-                        buf[i] = 0x00
-        return buf
+        return framebuffer.pack(image, self.width, self.height)
         
     def display(self, image):
         self.send_command(0x10)
         self.send_data2(image)
         self.send_command(0x12)
         epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.ReadBusy("refresh")
         
     def Clear(self):
         buf = [0x33] * int(self.width * self.height / 2)
         self.send_command(0x10)
         self.send_data2(buf)
         self.send_command(0x12)
-        self.ReadBusy()
+        self.ReadBusy("clear")
 
     def sleep(self):
         self.send_command(0x02) # POWER_OFF
-        self.ReadBusy()
+        self.ReadBusy("power_off")
         
         self.send_command(0x07) # DEEP_SLEEP
         self.send_data(0XA5)
@@ -27,16 +27,43 @@
 # THE SOFTWARE.
 #
 
+import collections
 import os
 import logging
+import struct
 import sys
 import time
-import subprocess
 
 from ctypes import *
 
 logger = logging.getLogger(__name__)
 
+# SPI settings of the spidev backends, can be overridden by environment variables
+SPI_SPEED_HZ = int(os.environ.get('EPD_SPI_SPEED_HZ', 4000000))
+# Bytes per write call, 0 writes the whole buffer in one call
+SPI_CHUNK_SIZE = int(os.environ.get('EPD_SPI_CHUNK_SIZE', 0))
+# Type the buffer is converted to before writing: list, bytes, memoryview or empty to keep it
+SPI_BUFFER_TYPE = os.environ.get('EPD_SPI_BUFFER_TYPE', '')
+
+
+def _spi_chunks(data, chunk_size, buffer_type):
+    # Converts the buffer and splits it into chunks for writing
+    if buffer_type == 'list':
+        if not isinstance(data, list):
+            data = list(data)
+    elif buffer_type == 'bytes':
+        if not isinstance(data, bytes):
+            data = bytes(data)
+    elif buffer_type == 'memoryview':
+        if isinstance(data, list):
+            data = bytes(data)
+        data = memoryview(data)
+    elif buffer_type:
+        raise ValueError("Unknown SPI buffer type %s" % buffer_type)
+    if chunk_size <= 0 or len(data) <= chunk_size:
+        return [data]
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
 
 class RaspberryPi:
     # Pin definition
@@ -59,50 +86,61 @@ class RaspberryPi:
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
 
-        
+        # Pin to device tables for digital_write and digital_read
+        self.GPIO_OUTPUTS = {
+            self.RST_PIN: self.GPIO_RST_PIN,
+            self.DC_PIN: self.GPIO_DC_PIN,
+            self.PWR_PIN: self.GPIO_PWR_PIN,
+        }
+        self.GPIO_INPUTS = dict(self.GPIO_OUTPUTS)
+        self.GPIO_INPUTS[self.BUSY_PIN] = self.GPIO_BUSY_PIN
+
+        self.spi_open = False
+        self.spi_speed_hz = SPI_SPEED_HZ
+        self.spi_chunk_size = SPI_CHUNK_SIZE
+        self.spi_buffer_type = SPI_BUFFER_TYPE
+
 
     def digital_write(self, pin, value):
-        if pin == self.RST_PIN:
-            if value:
-                self.GPIO_RST_PIN.on()
-            else:
-                self.GPIO_RST_PIN.off()
-        elif pin == self.DC_PIN:
+        device = self.GPIO_OUTPUTS.get(pin)
+        if device is not None:
             if value:
-                self.GPIO_DC_PIN.on()
+                device.on()
             else:
-                self.GPIO_DC_PIN.off()
-        # elif pin == self.CS_PIN:
-        #     if value:
-        #         self.GPIO_CS_PIN.on()
-        #     else:
-        #         self.GPIO_CS_PIN.off()
-        elif pin == self.PWR_PIN:
-            if value:
-                self.GPIO_PWR_PIN.on()
-            else:
-                self.GPIO_PWR_PIN.off()
+                device.off()
 
     def digital_read(self, pin):
-        if pin == self.BUSY_PIN:
-            return self.GPIO_BUSY_PIN.value
-        elif pin == self.RST_PIN:
-            return self.RST_PIN.value
-        elif pin == self.DC_PIN:
-            return self.DC_PIN.value
-        # elif pin == self.CS_PIN:
-        #     return self.CS_PIN.value
-        elif pin == self.PWR_PIN:
-            return self.PWR_PIN.value
+        device = self.GPIO_INPUTS.get(pin)
+        if device is not None:
+            return device.value
 
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_digital(self, pin, value, timeout_ms):
+        # Waits for the edge instead of polling, returns False on timeout
+        if pin != self.BUSY_PIN:
+            raise ValueError("Only the BUSY pin can be waited for")
+        if value:
+            return self.GPIO_BUSY_PIN.wait_for_press(timeout_ms / 1000.0)
+        return self.GPIO_BUSY_PIN.wait_for_release(timeout_ms / 1000.0)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        for chunk in _spi_chunks(data, self.spi_chunk_size, self.spi_buffer_type):
+            self.SPI.writebytes2(chunk)
+
+    def spi_config(self, speed_hz=None, chunk_size=None, buffer_type=None):
+        if speed_hz is not None:
+            self.spi_speed_hz = speed_hz
+            if self.spi_open:
+                self.SPI.max_speed_hz = speed_hz
+        if chunk_size is not None:
+            self.spi_chunk_size = chunk_size
+        if buffer_type is not None:
+            self.spi_buffer_type = buffer_type
 
     def DEV_SPI_write(self, data):
         self.DEV_SPI.DEV_SPI_SendData(data)
@@ -123,9 +161,9 @@ class RaspberryPi:
                 '/usr/lib',
             ]
             self.DEV_SPI = None
+            val = struct.calcsize("P") * 8
+            logging.debug("System is %d bit"%val)
             for find_dir in find_dirs:
-                val = int(os.popen('getconf LONG_BIT').read())
-                logging.debug("System is %d bit"%val)
                 if val == 64:
                     so_filename = os.path.join(find_dir, 'DEV_Config_64.so')
                 else:
@@ -141,13 +179,15 @@ class RaspberryPi:
         else:
             # SPI device, bus = 0, device = 0
             self.SPI.open(0, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.max_speed_hz = self.spi_speed_hz
             self.SPI.mode = 0b00
+            self.spi_open = True
         return 0
 
     def module_exit(self, cleanup=False):
         logger.debug("spi end")
         self.SPI.close()
+        self.spi_open = False
 
         self.GPIO_RST_PIN.off()
         self.GPIO_DC_PIN.off()
@@ -187,7 +227,21 @@ class JetsonNano:
                 self.SPI = ctypes.cdll.LoadLibrary(so_filename)
                 break
         if self.SPI is None:
-            raise RuntimeError('Cannot find sysfs_software_spi.so')
+            raise RuntimeError('Cannot find sysfs_software_spi.so, use EPD_PLATFORM=Virtual to run without hardware')
+
+        # Transfers a whole buffer in one call, see sysfs_software_spi_bulk.c
+        self.SPI_BULK = None
+        for find_dir in find_dirs:
+            so_filename = os.path.join(find_dir, 'sysfs_software_spi_bulk.so')
+            if os.path.exists(so_filename):
+                transfer_n = ctypes.cdll.LoadLibrary(so_filename).SYSFS_software_spi_transfer_n
+                transfer_n.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+                transfer_n.restype = None
+                transfer = ctypes.cast(self.SPI.SYSFS_software_spi_transfer, ctypes.c_void_p)
+                self.SPI_BULK = lambda data, length: transfer_n(transfer, data, length)
+                break
+        if self.SPI_BULK is None:
+            logger.debug("sysfs_software_spi_bulk.so not found, transferring byte by byte")
 
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
@@ -201,12 +255,40 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_digital(self, pin, value, timeout_ms):
+        # Waits for the edge instead of polling, returns False on timeout
+        edge = self.GPIO.RISING if value else self.GPIO.FALLING
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        while self.digital_read(pin) != value:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Wait in slices, an edge right before waiting would be missed otherwise
+            self.GPIO.wait_for_edge(pin, edge, timeout=max(1, int(min(remaining, 0.2) * 1000)))
+        return True
+
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        if self.SPI_BULK is None:
+            for i in range(len(data)):
+                self.SPI.SYSFS_software_spi_transfer(data[i])
+            return
+        if isinstance(data, bytes):
+            # Passed as pointer to the bytes object without copying
+            buf = data
+        else:
+            try:
+                buf = (c_ubyte * len(data)).from_buffer(data)
+            except TypeError:
+                # Lists and read-only buffers like the mapped frames file have to be copied
+                buf = bytes(data)
+        self.SPI_BULK(buf, len(data))
+
+    def spi_config(self, speed_hz=None, chunk_size=None, buffer_type=None):
+        # The software SPI has no clock setting and always transfers whole buffers
+        pass
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -249,6 +331,9 @@ class SunriseX3:
 
         self.GPIO = Hobot.GPIO
         self.SPI = spidev.SpiDev()
+        self.spi_speed_hz = SPI_SPEED_HZ
+        self.spi_chunk_size = SPI_CHUNK_SIZE
+        self.spi_buffer_type = SPI_BUFFER_TYPE
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -259,13 +344,36 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_digital(self, pin, value, timeout_ms):
+        # Waits for the edge instead of polling, returns False on timeout
+        edge = self.GPIO.RISING if value else self.GPIO.FALLING
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        while self.digital_read(pin) != value:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Wait in slices, an edge right before waiting would be missed otherwise
+            self.GPIO.wait_for_edge(pin, edge, timeout=max(1, int(min(remaining, 0.2) * 1000)))
+        return True
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
         # for i in range(len(data)):
         #     self.SPI.writebytes([data[i]])
-        self.SPI.xfer3(data)
+        for chunk in _spi_chunks(data, self.spi_chunk_size, self.spi_buffer_type):
+            self.SPI.xfer3(chunk)
+
+    def spi_config(self, speed_hz=None, chunk_size=None, buffer_type=None):
+        if speed_hz is not None:
+            self.spi_speed_hz = speed_hz
+            if self.Flag:
+                self.SPI.max_speed_hz = speed_hz
+        if chunk_size is not None:
+            self.spi_chunk_size = chunk_size
+        if buffer_type is not None:
+            self.spi_buffer_type = buffer_type
 
     def module_init(self):
         if self.Flag == 0:
@@ -282,7 +390,7 @@ class SunriseX3:
         
             # SPI device, bus = 0, device = 0
             self.SPI.open(2, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.max_speed_hz = self.spi_speed_hz
             self.SPI.mode = 0b00
             return 0
         else:
@@ -301,22 +409,162 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+class Virtual:
+    # Simulated display for testing and benchmarking without hardware, select it with EPD_PLATFORM=Virtual
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+    # Simulated busy time in ms after POWER_OFF, POWER_ON and DISPLAY_REFRESH
+    BUSY_MS  = {0x02: 100, 0x04: 200, 0x12: 4000}
+
+    def __init__(self):
+        # Factor for busy times and delays, 0 runs without waiting
+        self.time_scale = float(os.environ.get('EPD_VIRTUAL_TIME_SCALE', 1.0))
+        # Every refresh saves the frame as image to this file
+        self.png_file = os.environ.get('EPD_VIRTUAL_PNG', 'epd_virtual.png')
+        self.pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 0, self.PWR_PIN: 0}
+        self.busy_until = 0.0
+        self.command = None
+        self.data = bytearray()
+        self.frame = bytearray()
+        self.width = 640
+        self.height = 384
+        self.spi_speed_hz = SPI_SPEED_HZ
+        # Statistics
+        self.commands = collections.Counter()
+        self.bytes_written = 0
+        self.spi_calls = 0
+        self.refreshes = 0
+
+    def digital_write(self, pin, value):
+        self.pins[pin] = value
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if time.monotonic() < self.busy_until else 1
+        return self.pins.get(pin, 0)
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime * self.time_scale / 1000.0)
+
+    def wait_digital(self, pin, value, timeout_ms):
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        while self.digital_read(pin) != value:
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            time.sleep(max(0, min(self.busy_until, deadline) - now))
+        return True
+
+    def spi_writebyte(self, data):
+        self._receive(data)
+
+    def spi_writebyte2(self, data):
+        self._receive(data)
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
-else:
-    implementation = JetsonNano()
+    def spi_config(self, speed_hz=None, chunk_size=None, buffer_type=None):
+        if speed_hz is not None:
+            self.spi_speed_hz = speed_hz
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    def _receive(self, data):
+        self.spi_calls += 1
+        self.bytes_written += len(data)
+        if self.pins[self.DC_PIN]:
+            self.data.extend(data)
+        else:
+            for command in data:
+                self._command(command)
+
+    def _command(self, command):
+        # Data of the previous command is complete
+        if self.command == 0x10:
+            self.frame = self.data
+        elif self.command == 0x61 and len(self.data) == 4:    # TCON_RESOLUTION
+            self.width = (self.data[0] << 8) | self.data[1]
+            self.height = (self.data[2] << 8) | self.data[3]
+        self.command = command
+        self.data = bytearray()
+        self.commands[command] += 1
+        if command == 0x12:
+            self.refreshes += 1
+            self._save_png()
+        if command in self.BUSY_MS:
+            self.busy_until = time.monotonic() + self.BUSY_MS[command] * self.time_scale / 1000.0
+
+    def _save_png(self):
+        if len(self.frame) != self.width // 2 * self.height:
+            logger.warning("Refresh with %d bytes of data, expected %d" % (len(self.frame), self.width // 2 * self.height))
+            return
+        from PIL import Image
+        # Each byte holds two pixels, 0x3 is white
+        pixels = b"".join(map(_VIRTUAL_PIXELS.__getitem__, self.frame))
+        Image.frombytes('L', (self.width, self.height), pixels).save(self.png_file)
+        logger.info("Frame saved to %s" % self.png_file)
+
+    def module_init(self, cleanup=False):
+        self.pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self, cleanup=False):
+        self.pins[self.PWR_PIN] = 0
+        logger.info("%d commands, %d bytes in %d SPI calls, %d refreshes" % (
+            sum(self.commands.values()), self.bytes_written, self.spi_calls, self.refreshes))
+
+
+_VIRTUAL_PIXELS = [
+    bytes((255 if byte >> 4 == 0x3 else 0, 255 if byte & 0xF == 0x3 else 0))
+    for byte in range(256)
+]
+
+
+PLATFORMS = {
+    'RaspberryPi': RaspberryPi,
+    'JetsonNano': JetsonNano,
+    'SunriseX3': SunriseX3,
+    'Virtual': Virtual,
+}
+
+_implementation = None
+
+
+def detect_platform():
+    # Explicit choice, e.g. EPD_PLATFORM=RaspberryPi
+    platform = os.environ.get('EPD_PLATFORM')
+    if platform:
+        if platform not in PLATFORMS:
+            raise ValueError("Unknown EPD_PLATFORM %s, expected one of %s" % (platform, ", ".join(PLATFORMS)))
+        return platform
+    for model_file in ['/proc/device-tree/model', '/proc/cpuinfo']:
+        try:
+            with open(model_file, 'rb') as f:
+                if b'Raspberry' in f.read():
+                    return 'RaspberryPi'
+        except OSError:
+            pass
+    if os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+        return 'SunriseX3'
+    return 'JetsonNano'
+
+
+def get_implementation():
+    # The hardware is only set up, when it is used for the first time
+    global _implementation
+    if _implementation is None:
+        platform = detect_platform()
+        logger.debug("Platform: %s" % platform)
+        _implementation = PLATFORMS[platform]()
+    return _implementation
+
+
+def __getattr__(name):
+    # Forwards pins and functions to the implementation and caches them in the module
+    if name.startswith('_'):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(get_implementation(), name)
+    setattr(sys.modules[__name__], name, value)
+    return value
 
 ### END OF FILE ###
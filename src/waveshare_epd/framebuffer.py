@@ -0,0 +1,48 @@
+"""
+Conversion of images into the buffer format of the 7.5inch e-Paper.
+The panel takes 4 bits per pixel, two pixels per byte: 0x3 for white and 0x0 for black.
+This module does not touch any hardware, so it can be used without a display attached.
+"""
+
+import logging
+from typing import List
+
+WHITE: int = 0x33
+
+# Maps one byte of a mode "1" image (8 pixels, MSB first) to 4 bytes for the panel
+NIBBLES: List[bytes] = [
+    bytes(
+        (0x30 if byte & (0x80 >> (2 * i)) else 0x00)
+        | (0x03 if byte & (0x40 >> (2 * i)) else 0x00)
+        for i in range(4)
+    )
+    for byte in range(256)
+]
+
+
+def blank(width: int, height: int) -> bytes:
+    """
+    Returns a white buffer for a panel of the given size
+    """
+    return bytes([WHITE]) * (width // 2 * height)
+
+
+def pack(image, width: int, height: int) -> bytes:
+    """
+    Converts an image of width x height (or height x width, which is rotated) into the panel buffer.
+    Rows of a mode "1" image are padded to whole bytes, so for widths, which are not a multiple
+    of 8, the nibbles of the padding are dropped from each row.
+    """
+    imwidth, imheight = image.size
+    if imwidth == width and imheight == height:
+        image = image.convert("1")
+    elif imwidth == height and imheight == width:
+        image = image.rotate(90, expand=True).convert("1")
+    else:
+        logging.warning("Wrong image dimensions: must be %dx%d", width, height)
+        return blank(width, height)
+    packed: bytes = b"".join(map(NIBBLES.__getitem__, image.tobytes()))
+    if width % 8 == 0:
+        return packed
+    row: int = (width + 7) // 8 * 4
+    return b"".join(packed[start : start + width // 2] for start in range(0, len(packed), row))
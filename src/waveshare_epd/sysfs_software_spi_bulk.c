@@ -0,0 +1,20 @@
+/*
+ * Bulk transfer for sysfs_software_spi.so, which only transfers one byte per call.
+ * Calling it from Python costs one ctypes call per byte, 122880 per frame.
+ * This helper takes the transfer function of the library and a whole buffer instead.
+ *
+ * Build it next to epdconfig.py:
+ *   gcc -O2 -shared -fPIC -o sysfs_software_spi_bulk.so sysfs_software_spi_bulk.c
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+
+typedef uint8_t (*spi_transfer_t)(uint8_t value);
+
+void SYSFS_software_spi_transfer_n(spi_transfer_t transfer, const uint8_t *data, size_t len)
+{
+    for (size_t i = 0; i < len; i++) {
+        transfer(data[i]);
+    }
+}